@@ -13,11 +13,14 @@ import numpy as np
 import seaborn as sns
 
 from mappings.fnames import BOLD_FNAMES, ALL_BOLD_FNAMES, ALL_T1_FNAMES
-from utils.file_matcher import recursive_file_matcher
-from utils.sequence_report import sequence_report, sequence_report_with_units
+from utils.file_matcher import index_memento_files
+from utils.inventory import ScanInventory
 from utils.memento_structure import extract_info
+from utils.repetition_time import infer_missing_TRs
+from mappings.machines import load_machines
 
 MEMENTO_PATH = Path("/georges/memento/IRM")
+MONITO_PATH = Path("/georges/memento/BIDS/cati_monito_2.txt")
 
 # %% Display examples of slices invalid sequences
 
@@ -37,33 +40,19 @@ with PdfPages(f"output/QC/sub-{subject_id}_ses-{month}.pdf") as pdf:
         plt.close()
 
 # %% Report information on all the files which match authorised
-# BOLD file names. This can take some time.
-
-bold_nifti_paths = recursive_file_matcher(MEMENTO_PATH, ALL_BOLD_FNAMES)
-
-reports = []
-for bold_nifti_path in bold_nifti_paths:
-    print(bold_nifti_path)
-    reports.append(sequence_report_with_units(bold_nifti_path))
-    
-
-df = pd.DataFrame(
-    reports,
-    columns=[
-        "subject_id",
-        "centre",
-        "month",
-        "is_4D",
-        "Tr (s)",
-        "nifti_path",
-        "x",
-        "y",
-        "z",
-        "t",
-        "vox_units",
-        "time_units"
-    ]
-).drop_duplicates(subset=["subject_id", "centre", "month"])
+# BOLD file names. Only headers of new or modified files are read,
+# the others come from the inventory in the output directory.
+
+# Single walk of the memento tree, query the index afterwards
+index = index_memento_files(MEMENTO_PATH)
+bold_nifti_paths = index.paths(ALL_BOLD_FNAMES)
+
+with ScanInventory("output/scan_inventory.sqlite") as inventory:
+    n_read = inventory.refresh(bold_nifti_paths)
+    print(f"{n_read} new or modified files")
+    df = inventory.to_frame(bold_nifti_paths).drop_duplicates(
+        subset=["subject_id", "centre", "month"]
+    )
 # %% Plot some interesting results
 
 counts = df.groupby("centre").size().sort_values(ascending=False)
@@ -126,16 +115,13 @@ sns.countplot(temporal_outliers, y="centre")
 plt.title("Temporal outliers per centre (t < 120)")
 plt.xticks(range(4))
 plt.show()
-# %% Infer TR when it is missing
-
-def infer_TR(row, frame):
-    """
-    For a given row, returns the median TR from the same centre and
-    with the same number of slices.
-    """
-    msk = (frame.centre == row.centre) & (frame.z == row.z) & (frame["Tr (s)"] != 0)
-    return frame.loc[msk, "Tr (s)"].median()
-
-missing_TRs = df[df["Tr (s)"] == 0].copy()
-missing_TRs.loc[:, "inferred_TR"] = missing_TRs.apply(infer_TR, axis=1, args=[df])
-missing_TRs.to_csv("output/inferred_TR.csv")
+# %% Infer TR when it is missing, from the scans of the same centre
+# with the same number of slices, or else with the same machine
+
+machines = load_machines(MONITO_PATH)
+missing_TRs = infer_missing_TRs(
+    df,
+    machines=machines,
+    output_path="output/inferred_TR.csv"
+)
+missing_TRs.groupby("TR_source", dropna=False).size()
@@ -9,11 +9,19 @@ from pathlib import Path
 import os
 import json
 import warnings
+import zlib
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
+from bids_handlers.participants import ParticipantRegistry
 from mappings.sidecar import bold_sidecar
-from utils.file_matcher import recursive_file_matcher
+from utils.file_matcher import index_memento_files
 from utils.memento_structure import extract_info
+from utils.nifti_copy import copy_with_header
+from utils.atomic import atomic_output
+from utils.journal import ConversionJournal
+from utils.sequence_report import read_nifti_header
 from gzip import BadGzipFile
 
 
@@ -25,36 +33,41 @@ class Modality:
         self.sidecar = sidecar
 
 
-def memento_to_bids(
-    input_path: Path, 
+def convert_scan(
+    candidates,
     bids_path: Path,
     modality: Modality,
+    reencode: bool = False
     ):
     """
-    Bidsifies the content of the input_dir,
-    which should use the memento convention,
-    and put it under the bids_path.
-    Args:
-        modality (Modality): Object describing the
-        modality that's being transfered. For now
-        the transfer is done one modality at a time.
-    """
+    Converts one (subject, session) pair of the given modality.
+    Candidates are tried in priority order and the first one
+    which can be written is kept.
 
-    
-    gen = recursive_file_matcher(input_path, modality.memento_name)
+    Args:
+        candidates (list): Paths of the memento files available
+        for this subject and session, sorted by priority.
+        bids_path (Path): Root of the BIDS directory.
+        modality (Modality): Modality that's being transfered.
+        reencode (bool, optional): Decode and save the image with
+        nibabel instead of patching the header bytes. Defaults to False.
 
-    for fpath in gen:
+    Returns:
+        tuple: (site, sub, ses, fpath) of the converted scan, None if
+        no candidate could be written.
+    """
+    for fpath in candidates:
 
-        # Check and update header
-        nifti_img = nib.load(fpath)
-        hdr = nifti_img.header
+        # Check and update header, voxel data is not read
+        src_hdr = read_nifti_header(fpath)
+        hdr = src_hdr.copy()
 
         if hdr["dim"][0] != 4 and modality.bids_modality == "func":
             print(f"{fpath} is not a 4D sequence, skipping to next file.")
             continue
         # Ensure units are written in header
         if modality.bids_modality == "func":
-            nifti_img.header.set_xyzt_units(xyz="mm", t="sec")
+            hdr.set_xyzt_units(xyz="mm", t="sec")
 
         # Create arborescense
         site, ses, sub = extract_info(fpath)
@@ -62,60 +75,184 @@ def memento_to_bids(
         bids_fname = f"sub-{sub}_ses-{ses}_{modality.suffix}"
         nifti_dest_fpath = bids_fpath / (bids_fname + ".nii.gz")
         
+        sidecar_fpath = bids_fpath / (bids_fname + ".json")
+        
+        # Images are written atomically, so an existing one is complete
         if os.path.isfile(nifti_dest_fpath): # Checking earlier could be more efficient
             warnings.warn(f"{nifti_dest_fpath} already exists, nothing has been written")
-            continue
-        else:
-            try:
-                os.makedirs(
-                    bids_fpath,
-                    exist_ok=True
-                )
-                nib.save(nifti_img, nifti_dest_fpath)
-            except BadGzipFile:
-                warnings.warn(f"gzip error when saving {nifti_dest_fpath}, skipping scan")
-                continue
+            return site, sub, ses, fpath
+
+        os.makedirs(
+            bids_fpath,
+            exist_ok=True
+        )
 
-        # Set repetition time for sidecar, write in dir
+        # Set repetition time for sidecar, write in dir.
+        # The sidecar goes first, an image in place means
+        # the whole scan has been converted
         if modality.sidecar is not None:
-            modality.sidecar["RepetitionTime"] = float(hdr["pixdim"][4])
-            with open(bids_fpath / (bids_fname + ".json"), "w") as f:
-                json.dump(modality.sidecar, f)
-
-        # Update participants list if necessary
-        with open(bids_path / "participants.tsv", 'r+') as f:
-            participant_exists = any(sub in line for line in f)
-            if not participant_exists:
-                f.write(f"sub-{sub}\t{site}\n")
+            sidecar = {
+                **modality.sidecar,
+                "RepetitionTime": float(hdr["pixdim"][4])
+            }
+            with atomic_output(sidecar_fpath) as tmp_fpath:
+                with open(tmp_fpath, "w") as f:
+                    json.dump(sidecar, f)
+
+        try:
+            with atomic_output(nifti_dest_fpath) as tmp_fpath:
+                if reencode:
+                    nifti_img = nib.load(fpath)
+                    nifti_img.header.set_xyzt_units(*hdr.get_xyzt_units())
+                    nib.save(nifti_img, tmp_fpath)
+                else:
+                    copy_with_header(fpath, tmp_fpath, hdr, src_hdr)
+        except (BadGzipFile, EOFError, zlib.error):
+            warnings.warn(f"gzip error when saving {nifti_dest_fpath}, skipping scan")
+            if os.path.isfile(sidecar_fpath):
+                os.remove(sidecar_fpath)
+            continue
     
         print(site, bids_fname)
+        return site, sub, ses, fpath
+
+    return None
+
+
+def group_candidates(fpaths, memento_fnames):
+    """
+    Groups memento files by (subject, session). Files of each group
+    are sorted following the order of memento_fnames, and groups
+    are ordered as a serial run over memento_fnames would visit them.
+    """
+    priority = {fname: rank for rank, fname in enumerate(memento_fnames)}
+    ranked = sorted(
+        enumerate(fpaths),
+        key=lambda item: (priority[item[1].name], item[0])
+    )
+
+    groups = {}
+    for _, fpath in ranked:
+        _, ses, sub = extract_info(fpath)
+        groups.setdefault((sub, ses), []).append(fpath)
+    return groups
+
+
+def memento_to_bids(
+    input_path: Path, 
+    bids_path: Path,
+    modality: Modality,
+    jobs: int = 1,
+    index=None,
+    reencode: bool = False,
+    participants=None,
+    journal=None
+    ):
+    """
+    Bidsifies the content of the input_dir,
+    which should use the memento convention,
+    and put it under the bids_path.
+    Args:
+        modality (Modality): Object describing the
+        modality that's being transfered. For now
+        the transfer is done one modality at a time.
+        memento_name should be ordered by priority.
+        jobs (int, optional): Number of worker processes
+        used for the conversion. Defaults to 1.
+        index (MementoIndex, optional): Index of input_path,
+        shared between modalities to avoid walking the
+        tree several times. Built if not provided.
+        reencode (bool, optional): Go through nibabel to write
+        images instead of copying them with a patched header.
+        Defaults to False.
+        participants (ParticipantRegistry, optional): Registry
+        where converted participants are added. If not provided,
+        participants.tsv is loaded and written back at the end.
+        journal (ConversionJournal, optional): Journal of completed
+        conversions. Scans found in it are skipped without looking
+        at the BIDS directory, and new ones are recorded as soon
+        as they are written.
+    """
+    if index is None:
+        index = index_memento_files(input_path, modality.memento_name)
+    groups = group_candidates(
+        index.paths(modality.memento_name),
+        modality.memento_name
+    )
+
+    if journal is not None:
+        groups = {
+            (sub, ses): fpaths for (sub, ses), fpaths in groups.items()
+            if (sub, ses, modality.suffix) not in journal
+        }
+
+    # Only the main process touches the registry and the journal
+    if participants is None:
+        registry = ParticipantRegistry.from_path(bids_path / "participants.tsv")
+    else:
+        registry = participants
+
+    candidates = list(groups.values())
+    if jobs > 1:
+        pool = ProcessPoolExecutor(max_workers=jobs)
+        # map keeps the submission order, so that participants
+        # are registered in the same order as a serial run
+        results = pool.map(
+            convert_scan,
+            candidates,
+            repeat(bids_path),
+            repeat(modality),
+            repeat(reencode),
+            chunksize=max(1, len(candidates) // (jobs * 8))
+        )
+    else:
+        pool = None
+        results = (
+            convert_scan(fpaths, bids_path, modality, reencode)
+            for fpaths in candidates
+        )
+
+    try:
+        # Results are consumed as they come, so the journal
+        # is up to date if the run is interrupted
+        for res in results:
+            if res is None:
+                continue
+            site, sub, ses, fpath = res
+            registry.add(sub, centre=site)
+            if journal is not None:
+                journal.record(sub, ses, modality.suffix, site, fpath)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    if participants is None:
+        registry.write()
 
 
 # These could be abstracted further but let's be explicit
-def t1w_to_bids(inp, outp):
+def t1w_to_bids(inp, outp, **kwargs):
     from mappings.fnames import ALL_T1_FNAMES
     print("Order of matching :")
     print(ALL_T1_FNAMES)
-    for t1_fname in ALL_T1_FNAMES:
-        t1 = Modality(
-            {t1_fname},
-            "anat",
-            "T1w"
-        )
-        memento_to_bids(inp, outp, t1)
+    t1 = Modality(
+        ALL_T1_FNAMES,
+        "anat",
+        "T1w"
+    )
+    memento_to_bids(inp, outp, t1, **kwargs)
 
-def bold_to_bids(inp, outp):
+def bold_to_bids(inp, outp, **kwargs):
     from mappings.fnames import ALL_BOLD_FNAMES
     print("Order of matching :")
     print(ALL_BOLD_FNAMES)
-    for bold_fname in ALL_BOLD_FNAMES:
-        rsfmri = Modality(
-            {bold_fname},
-            "func",
-            "task-rest_bold",
-            sidecar=bold_sidecar
-        )
-        memento_to_bids(inp, outp, rsfmri)
+    rsfmri = Modality(
+        ALL_BOLD_FNAMES,
+        "func",
+        "task-rest_bold",
+        sidecar=bold_sidecar
+    )
+    memento_to_bids(inp, outp, rsfmri, **kwargs)
         
 def init_argparse() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
@@ -141,6 +278,36 @@ def init_argparse() -> argparse.ArgumentParser:
         empty BIDS files if it does not exist.
         """
     )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        help="""
+        Number of processes used to convert scans in parallel.
+        The output is the same as a serial run.
+        """
+    )
+    parser.add_argument(
+        "--reencode",
+        action="store_true",
+        help="""
+        Load and save images with nibabel. By default, images are
+        copied with a patched header, without decoding voxel data.
+        """
+    )
+    parser.add_argument(
+        "--journal",
+        nargs="?",
+        const="",
+        default=None,
+        help="""
+        Record completed scans in a journal, by default
+        code/memento2bids_journal.tsv in the BIDS directory.
+        When restarted with the same journal, an interrupted
+        conversion skips the scans which are already done, so
+        a long conversion can be split over several jobs.
+        """
+    )
     return parser
 
 if __name__ == "__main__":
@@ -183,6 +350,31 @@ if __name__ == "__main__":
         open(bids_path / "README", "w").close()
         open(bids_path / ".bidsignore", "w").close()
 
-    t1w_to_bids(input_path, bids_path)
-    bold_to_bids(input_path, bids_path)
+    # Walk the input tree once for both modalities
+    index = index_memento_files(input_path)
+    participants = ParticipantRegistry.from_path(bids_path / "participants.tsv")
+
+    journal = None
+    if args.journal is not None:
+        journal_path = args.journal or bids_path / "code" / "memento2bids_journal.tsv"
+        os.makedirs(os.path.dirname(journal_path) or ".", exist_ok=True)
+        journal = ConversionJournal(journal_path)
+        # A previous run may have stopped before writing participants
+        for entry in journal.values():
+            participants.add(entry["sub"], centre=entry["site"])
+
+    conversion_args = dict(
+        jobs=args.jobs,
+        index=index,
+        reencode=args.reencode,
+        participants=participants,
+        journal=journal
+    )
+    try:
+        t1w_to_bids(input_path, bids_path, **conversion_args)
+        bold_to_bids(input_path, bids_path, **conversion_args)
+    finally:
+        if journal is not None:
+            journal.close()
+    participants.write()
 
@@ -27,6 +27,8 @@ INPUT_PATH = Path("/scratch/memento_sample_bids")
 layout = BIDSLayout(INPUT_PATH)
 
 TRs = pd.read_csv(TR_PATH, index_col=0, dtype={"subject_id": str})
+# Some TRs could not be inferred from any other scan
+TRs = TRs.dropna(subset=["inferred_TR"])
 # %%
 
 for _, row in TRs.iterrows():
@@ -6,18 +6,20 @@ early because they make mriqc crash
 import numpy as np
 import nibabel as nib
 import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
 import pandas as pd
 import seaborn as sns
-from scipy.signal import convolve2d, periodogram
+from scipy.signal import convolve2d
 
 from pathlib import Path
 import random
 from bids import BIDSLayout
 
-from qc.sum_of_gradients import middle_gradients_qa, sobel_x
+from qc.sum_of_gradients import middle_gradients_qa_batch, sobel_x, PLANES
+from qc.stripes import detect_permutation
 from utils.visualisation import make_and_show_middle_slices
-from transformations.permutation import destripe_img, convert_outliers
+from utils.reductions import temporal_mean
+from utils.reports import render_reports, ReportPage
+from transformations.permutation import convert_outliers
 
 INPUT_PATH = Path("/scratch/memento_sample_bids")
 random.seed(1234)
@@ -38,22 +40,23 @@ rsfmris = layout.get(suffix="bold", extension="nii.gz")
 control_rsfmri = random.choice(rsfmris)
 
 
-bad_img = nib.load(bad_rsfmri.path).get_fdata()
+# Streamed means, the series are never fully loaded
+bad_mean = temporal_mean(bad_rsfmri.path)
 bhdr = nib.load(bad_rsfmri.path).header
-control_img = nib.load(control_rsfmri.path).get_fdata()
+control_mean = temporal_mean(control_rsfmri.path)
 
 # %% Show gradient magnitude examples
 
-make_and_show_middle_slices(bad_img.mean(axis=3))
+make_and_show_middle_slices(bad_mean)
 plt.suptitle(f"sub-{bad_rsfmri.entities['subject']}, mean over time")
 plt.show()
 
-make_and_show_middle_slices(control_img.mean(axis=3))
+make_and_show_middle_slices(control_mean)
 plt.suptitle(f"sub-{control_rsfmri.entities['subject']}, mean over time")
 plt.show()
 
-imb = bad_img[30, :, :, :].mean(axis=2)
-imc = control_img[30, :, :, :].mean(axis=2)
+imb = bad_mean[30, :, :]
+imc = control_mean[30, :, :]
 
 # Gradients magnitude along x axis should be low
 # for permuted brains
@@ -97,17 +100,36 @@ plt.show()
         
 # %% Detect outliers
 
-global_qa = []
 rsfmris = layout.get(suffix="bold", extension="nii.gz")
-for i, rsfmri in enumerate(rsfmris):
-    print(f"{rsfmri.filename} {i + 1}/{len(rsfmris)}")
-    image = nib.load(rsfmri.path).get_fdata()
-    qa = dict(middle_gradients_qa(image))
-    subject_dict = {**qa, **rsfmri.entities}
-    global_qa.append(subject_dict)
 
-df = pd.DataFrame(global_qa)
+def mean_volumes(rsfmris):
+    for i, rsfmri in enumerate(rsfmris):
+        print(f"{rsfmri.filename} {i + 1}/{len(rsfmris)}")
+        yield temporal_mean(rsfmri.path)
 
+# Gradients of all the scans are computed at once
+qa = middle_gradients_qa_batch(mean_volumes(rsfmris))
+
+df = pd.concat(
+    (
+        pd.DataFrame(qa, columns=PLANES),
+        pd.DataFrame([rsfmri.entities for rsfmri in rsfmris])
+    ),
+    axis=1
+)
+
+
+# %% Cheaper screen, reading only a few volumes of each scan.
+# Normal series repeat the same profile along z in every volume,
+# permuted ones don't
+
+screen = pd.DataFrame(
+    [
+        {**detect_permutation(rsfmri.path), **rsfmri.entities}
+        for rsfmri in rsfmris
+    ]
+)
+screen[screen.permuted]
 
 # %%
 m = df.melt(
@@ -147,51 +169,23 @@ import os
 outliers = pd.read_csv("output/permuted_brains.csv", index_col=0)
 
 os.makedirs("/tmp/permutation_experiment", exist_ok=True)
-convert_outliers(outliers, layout, overwrite_bids=False)
+convert_outliers(outliers, layout, overwrite_bids=False, n_jobs=8)
 
 # %% 
     
-def generate_reports(outliers):
+def generate_reports(outliers, n_jobs=8):
+    reports = {}
     for _, s in outliers.iterrows():
         bids_name = f"{s.participant_id}_ses-{s.session}_task-rest_bold.nii.gz"
-        print(bids_name)
-        with PdfPages(f"output/QC/{bids_name}.pdf") as pdf:
-            reloaded_img = nib.load(
-                f"/tmp/permutation_experiment/{bids_name}"
-            )
-
-            reloaded_arr = reloaded_img.get_fdata()
-
-            make_and_show_middle_slices(reloaded_arr.mean(axis=3))
-            plt.suptitle("Corrected, mean over time")
-            pdf.savefig()
-            plt.close()
-
-            make_and_show_middle_slices(reloaded_arr[:, :, :, -1])
-            plt.suptitle("Last TR")
-            pdf.savefig()
-            plt.close()
-
-            ts = reloaded_arr.mean(axis=(0, 1, 2))
-            TR = reloaded_img.header["pixdim"][4]
-            n_TR = reloaded_arr.shape[-1]
-            t_axis = np.linspace(0, TR * n_TR, len(ts))
-            plt.plot(t_axis, ts)
-            plt.title("Global signal")
-            plt.xlabel("Time (s)")
-            pdf.savefig()
-            plt.close()
-
-            f, Pxx = periodogram(
-                ts,
-                fs=1/TR
-            )
-            plt.plot(f, Pxx)
-            plt.xlabel('frequency [Hz]')
-            plt.ylabel('PSD [V**2/Hz]')
-            plt.title("Periodogram")
-            pdf.savefig()
-            plt.close()
+        corrected_path = f"/tmp/permutation_experiment/{bids_name}"
+        # The pages of a scan are drawn from a single streamed pass
+        reports[f"output/QC/{bids_name}.pdf"] = [
+            ReportPage(corrected_path, "mean", "Corrected, mean over time"),
+            ReportPage(corrected_path, "last", "Last TR"),
+            ReportPage(corrected_path, "global_signal", "Global signal"),
+            ReportPage(corrected_path, "periodogram", "Periodogram"),
+        ]
+    render_reports(reports, n_jobs=n_jobs)
 
  # Output a report for each outlier,
  # to assess whether reconstruction worked
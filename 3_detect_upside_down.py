@@ -15,11 +15,15 @@ import seaborn as sns
 import bids
 from bids import BIDSLayout
 
-from utils.visualisation import make_and_show_middle_slices
+from utils.visualisation import make_and_show_middle_slices, show_thumbnail
+from utils.thumbnails import thumbnails_path
+from utils.reports import render_reports, ReportPage
 
-from qc.scanner_space import distance_between_FOVs
+from qc.scanner_space import bulk_distance_between_FOVs
+from bids_handlers.path_tools import bids_entities, bids_reference_path
 
 INPUT_PATH = Path("/scratch/memento_sample_bids")
+N_JOBS = 8
 try:
     layout = BIDSLayout.load("pybids_samples")
 except TypeError:
@@ -31,48 +35,36 @@ except TypeError:
     )
 # %% Show a known example
 SUBJECT = "0142"
-boldf = layout.get(subject=SUBJECT, session="M000", suffix="bold", extension=".nii.gz")[0]
 t1wf = layout.get(subject=SUBJECT, session="M000", suffix="T1w", extension=".nii.gz")[0]
 
-bold_img = nib.load(boldf.path)
 t1w_img = nib.load(t1wf.path)
-bold_arr = bold_img.get_fdata()
 t1w_arr = t1w_img.get_fdata()
 
-make_and_show_middle_slices(bold_arr)
+# Thumbnails are stored by 3_run_qc, the bold series is not read
+show_thumbnail(thumbnails_path(INPUT_PATH), SUBJECT, "M000")
 plt.show()
 
 make_and_show_middle_slices(t1w_arr.transpose(2, 0, 1))
 plt.show()
 # %%
 
-qa = []
-rsfmris = layout.get(suffix="bold", extension="nii.gz")
-for i, rsfmri in enumerate(rsfmris):
-    subject = rsfmri.entities["subject"]
-    session = rsfmri.entities["session"]
+# Only headers are read, and references are found from
+# the BIDS file names instead of querying the layout
+rsfmris = sorted(
+    path for path in INPUT_PATH.glob("sub-*/ses-*/func/*_bold.nii.gz")
+    if "acq-rejected" not in path.name
+)
+pairs = [(rsfmri, bids_reference_path(rsfmri)) for rsfmri in rsfmris]
+for rsfmri, reference in pairs:
+    if reference is None:
+        warnings.warn(f"{rsfmri} has no T1w reference image, skipping")
 
-    try:
-        reference = layout.get(
-            subject=subject,
-            session=session,
-            suffix="T1w",
-            extension=".nii.gz"
-        )[0]
-    except IndexError:
-        warnings.warn(f"{rsfmri.path} has no T1w reference image, skipping")
-        continue
-
-    reference_img = nib.load(reference.path)
-    rsfmri_img = nib.load(rsfmri.path)
-    
-    subject_dict = {
-        **{"distance_FOVs" : distance_between_FOVs(reference_img, rsfmri_img)},
-        **rsfmri.entities
-    }
-    qa.append(subject_dict)
-
-df = pd.DataFrame(qa)
+df = bulk_distance_between_FOVs(
+    (rsfmri, reference) for rsfmri, reference in pairs if reference is not None
+)
+df = pd.concat(
+    [df, pd.DataFrame(map(bids_entities, df.epi_path))], axis=1
+)
 
 # %%
 sns.boxplot(df, x="distance_FOVs")
@@ -81,21 +73,21 @@ plt.show()
 
 # %% Export subjects with high distances
 msk = df.distance_FOVs > 50
-from matplotlib.backends.backend_pdf import PdfPages
 
-with PdfPages("output/QC/descending.pdf") as pdf:
-    for i, row in df[msk].sort_values(by="distance_FOVs", ascending=False).iterrows():
-        # Should have added path in df but whatever
-        rsfmri = layout.get(
-           subject=row.subject,
-           session=row.session,
-           suffix="bold",
-           extension=".nii.gz"
-        )[0]
-        img = nib.load(rsfmri.path)
-        make_and_show_middle_slices(img.get_fdata())
-        plt.suptitle(f"{rsfmri.filename}\nd={row.distance_FOVs:.2f}mm")
-        pdf.savefig()
-        plt.close()
+render_reports(
+    {
+        "output/QC/descending.pdf": [
+            ReportPage(
+                row.epi_path,
+                "mean",
+                f"{Path(row.epi_path).name}\nd={row.distance_FOVs:.2f}mm"
+            )
+            for _, row in df[msk].sort_values(
+                by="distance_FOVs", ascending=False
+            ).iterrows()
+        ]
+    },
+    n_jobs=N_JOBS
+)
 
 # %%
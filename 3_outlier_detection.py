@@ -7,41 +7,39 @@ to generate IQM are stored in participants_mriqc.slurm
 import pandas as pd
 import os
 from pathlib import Path
-from sklearn.ensemble import IsolationForest
 import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
-from sklearn.pipeline import make_pipeline, Pipeline
+from sklearn.pipeline import make_pipeline
 from sklearn.preprocessing import StandardScaler, Normalizer
 from sklearn.decomposition import PCA
-import nibabel as nib
 from bids import BIDSLayout
 
-from matplotlib.backends.backend_pdf import PdfPages
-
-from utils.visualisation import make_and_show_middle_slices
+from utils.reports import render_reports, ReportPage
+from bids_handlers.mriqc import load_mriqc_group
+from qc.outlier_detection import (
+    fit_iqm_model,
+    load_iqm_model,
+    score_new_scans
+)
 from mappings.iqms import *
 
 MODALITY = "bold"
 CENTRE = "all"
+# Fit the model again instead of only scoring the new scans
+REFIT = False
+N_JOBS = -1
+MODEL_PATH = Path(f"output/QC/iqm_model_{MODALITY}_{CENTRE}.joblib")
+SCORES_PATH = Path(f"output/QC/iqm_scores_{MODALITY}_{CENTRE}.csv")
 
 # %%
 input_path = Path("/georges/memento/BIDS")
 
-qc = pd.read_csv(
-    input_path / f"derivatives/mriqc/group_{MODALITY}.tsv",
-    sep="\t"
-)
-
-participants = pd.read_csv(input_path / "participants.tsv", sep="\t")
-qc["participant_id"] = qc["bids_name"].apply(
-    lambda x: x.split("_")[0]
-)
-# Avoid IQMs that discriminate on size and space
-cols = summary_bg + summary_fg + structural + afni + ghosts + fd
-qc = qc.loc[:, cols + ["participant_id", "bids_name"]]
-
-merged = pd.merge(qc, participants, how="inner").dropna()
+# Only the IQMs are read, avoiding those that discriminate on size and space
+merged = load_mriqc_group(input_path, MODALITY, iqms=outlier_detection)
+# Some IQMs are not computed by mriqc for anatomical scans
+cols = [col for col in outlier_detection if col in merged.columns]
+merged = merged.dropna(subset=cols)
 if CENTRE != "all":
     merged = merged[merged.centre == CENTRE]
 
@@ -56,19 +54,21 @@ except TypeError: # This is the stupidest thing to raise
     )
 # %%
 
-X = merged.select_dtypes(np.number)
+os.makedirs("output/QC", exist_ok=True)
+if REFIT or not MODEL_PATH.exists():
+    model = fit_iqm_model(merged, MODEL_PATH, columns=cols, n_jobs=N_JOBS)
+    # Scores of the previous model are not comparable
+    if SCORES_PATH.exists():
+        os.remove(SCORES_PATH)
+else:
+    model = load_iqm_model(MODEL_PATH)
+
+# Only the scans which are not in SCORES_PATH yet are scored
+scores = score_new_scans(model, merged, SCORES_PATH)
+merged = pd.merge(merged, scores, on="bids_name", how="left")
 
-pipe = Pipeline(
-    [
-        ("scaler", StandardScaler()),
-        ("pca", PCA(n_components=15)),
-        ("clf", IsolationForest(random_state=1234))
-    ]
-)
-pipe.fit(X)
-y_pred = pipe.predict(X)
-X_scores = pipe.decision_function(X)
-clf_name = pipe.named_steps['clf'].__str__()
+X = merged.loc[:, model["columns"]]
+clf_name = type(model["pipeline"].named_steps["clf"]).__name__
 
 # %% Visualize results in plane using PCA and pairplots
 vis_pipe = make_pipeline(
@@ -78,10 +78,8 @@ vis_pipe = make_pipeline(
 )
 X_reduced = vis_pipe.fit_transform(X)
 
-quality_score = 1 - (X_scores.max() - X_scores) / (X_scores.max() - X_scores.min())
-
 df = pd.DataFrame(X_reduced[:, :4])
-df["quality_score"] = quality_score
+df["quality_score"] = merged.quality_score.to_numpy()
 sns.pairplot(
     df,
     hue="quality_score",
@@ -106,7 +104,6 @@ plt.show()
 
 # %% Sort by quality score
 
-merged["quality_score"] = quality_score 
 sorted = merged.sort_values(by="quality_score", ascending=True)
 # %% Show outliers
 
@@ -116,29 +113,26 @@ else:
     argnames = ["subject", "session", "suffix"]
 
 
-os.makedirs("output/QC", exist_ok=True)
-with PdfPages(
-    f"output/QC/{clf_name}_pca_{MODALITY}_{CENTRE}_15comps.pdf"
-) as pdf:
-    for _, row in sorted[sorted.quality_score < 0.3].iterrows():
-
-        targets = row.bids_name.split("_")
-        kwargs = dict(zip(argnames, targets))
-        kwargs = {k: v.split("-")[-1] for k, v in kwargs.items()}
+pages = []
+for _, row in sorted[sorted.quality_score < 0.3].iterrows():
 
-        rsfmri = layout.get(**kwargs, extension="nii.gz")[0]
+    targets = row.bids_name.split("_")
+    kwargs = dict(zip(argnames, targets))
+    kwargs = {k: v.split("-")[-1] for k, v in kwargs.items()}
 
-        arr = nib.load(rsfmri.path).get_fdata()
+    rsfmri = layout.get(**kwargs, extension="nii.gz")[0]
 
-        if MODALITY == "bold":
-            make_and_show_middle_slices(arr.mean(axis=3))
-        else:
-            make_and_show_middle_slices(arr)
+    # Bold series are averaged over time while streaming
+    pages.append(ReportPage(
+        rsfmri.path,
+        "mean",
+        row.bids_name + " " + row.centre + f" q = {row.quality_score:.2f}"
+    ))
 
-        plt.suptitle(
-            row.bids_name + " " + row.centre + f" q = {row.quality_score:.2f}")
-        pdf.savefig()
-        plt.close()
+render_reports(
+    {f"output/QC/{clf_name}_pca_{MODALITY}_{CENTRE}_15comps.pdf": pages},
+    n_jobs=N_JOBS
+)
 
 # %% Plot quality score as a function of rank
 y = sorted.quality_score.to_numpy()
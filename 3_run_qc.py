@@ -0,0 +1,60 @@
+"""
+Run all the in-house detectors in a single pass over the
+bold series: gradients of the middle slices and periodicity
+of the first volumes (permuted brains),
+distance between FOVs (upside down brains), EFC of the mean
+volume and of each volume, and odd/even slices lag.
+Each scan is decompressed only once and all the
+metrics end up in the same table.
+"""
+# %%
+from pathlib import Path
+import os
+
+from bids_handlers.path_tools import bids_entities, bids_reference_path
+from qc.engine import (
+    run_qc,
+    GradientsDetector,
+    StripeDetector,
+    FOVDistanceDetector,
+    EFCDetector,
+    LagDetector,
+    ThumbnailDetector
+)
+from utils.thumbnails import ThumbnailStore, thumbnails_path
+
+INPUT_PATH = Path("/scratch/memento_sample_bids")
+
+# %%
+rsfmri_paths = sorted(
+    path for path in INPUT_PATH.glob("sub-*/ses-*/func/*_bold.nii.gz")
+    if "acq-rejected" not in path.name
+)
+
+# Middle slices are stored on the way, for visual QC
+# with utils.visualisation.show_thumbnail
+thumbnails = ThumbnailStore(thumbnails_path(INPUT_PATH))
+
+detectors = [
+    GradientsDetector(),
+    StripeDetector(),
+    FOVDistanceDetector(bids_reference_path),
+    EFCDetector(),
+    LagDetector(),
+    ThumbnailDetector(thumbnails)
+]
+
+os.makedirs("output/QC", exist_ok=True)
+df = run_qc(rsfmri_paths, detectors, output_path="output/QC/qc_metrics.csv")
+
+# %% Thumbnails of the anatomical references
+for t1w_path in sorted(INPUT_PATH.glob("sub-*/ses-*/anat/*_T1w.nii.gz")):
+    entities = bids_entities(t1w_path)
+    if (entities["subject"], entities["session"], "T1w", "mean") not in thumbnails:
+        thumbnails.add_scan(t1w_path)
+thumbnails.close()
+
+# %% Same thresholds as the dedicated scripts
+df[(df.sagittal < 1000) | (df.periodicity < 0.5) | (df.distance_FOVs > 50)]
+
+# %%
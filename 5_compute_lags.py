@@ -10,24 +10,34 @@ machines during the course of the study.
 """
 # %%
 import numpy as np
-import nibabel as nib
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
 from scipy import signal
 
+import os
 from pathlib import Path
 from bids import BIDSLayout
 import bids
 
 from utils.visualisation import make_and_show_middle_slices
-from slice_timing.correlation import make_slice_corr_map, odd_slices_lag, rsfmri_lag
+from utils.signal_cache import cached_slice_signals
+from slice_timing.correlation import (
+    make_slice_corr_map,
+    odd_slices_lag,
+    SliceCorrelationMaps
+)
+from slice_timing.batch import batch_lags
 from slice_timing.plotting import show_slice_timing
 from mappings.centres import fetch_centre
 from mappings.slice_timing import multiband_slice_timing
 
 INPUT_PATH = Path("/georges/memento/BIDS")
 SHOW_SLICES = False
+N_JOBS = int(os.environ.get("SLURM_CPUS_PER_TASK", 8))
+# "fft" refines the lag below the TR without oversampling,
+# "resample" is the original estimator, with a 0.1 TR resolution
+LAG_METHOD = "fft"
 
 # %% Load data
 
@@ -68,14 +78,13 @@ for centre in rsfmris.centre.unique():
     # Why such a backward logic
     rsfmri = bids.layout.models.BIDSFile(sample_path)
     rsfmri.centre = sample.centre.values[0]
-    img = nib.load(rsfmri.path).get_fdata()
 
     if SHOW_SLICES:
-        make_and_show_middle_slices(img.mean(axis=3))
+        make_and_show_middle_slices(rsfmri.path)
         plt.suptitle(rsfmri.filename)
         plt.show()
 
-    mat, corr_map = make_slice_corr_map(img)
+    mat, corr_map = make_slice_corr_map(rsfmri.path)
 
     fig, axes = plt.subplots(1, 2, figsize=(16, 6))
     fig.suptitle(f"{rsfmri.filename}, centre {rsfmri.centre}")
@@ -100,6 +109,42 @@ for centre in rsfmris.centre.unique():
 odd_slices_lag(mat)
 
 
+# %% Compare the slice correlation structure of many scans per centre.
+# Interleaved acquisitions correlate more between slices which are
+# two apart than between adjacent slices
+N_SCANS_PER_CENTRE = 20
+centres = rsfmris.centre.unique()
+fig, axes = plt.subplots(1, len(centres), figsize=(4 * len(centres), 4))
+contrasts = []
+for ax, centre in zip(np.atleast_1d(axes), centres):
+    sample = rsfmris[rsfmris.centre == centre]
+    sample = sample.sample(n=min(N_SCANS_PER_CENTRE, len(sample)))
+    corr_maps = SliceCorrelationMaps(
+        [cached_slice_signals(path) for path in sample.path]
+    )
+
+    sns.heatmap(
+        np.nanmean(corr_maps.maps, axis=0),
+        cmap="magma",
+        ax=ax,
+        square=True,
+        cbar=False
+    )
+    ax.set_title(centre)
+    contrasts.append(pd.DataFrame({
+        "centre": centre,
+        "path": sample.path.to_numpy(),
+        "interleave_contrast": corr_maps.neighbour_correlation(2)
+        - corr_maps.neighbour_correlation(1)
+    }))
+fig.suptitle("Mean slice signals correlation")
+plt.show()
+
+sns.boxplot(pd.concat(contrasts), x="interleave_contrast", y="centre")
+plt.xlabel("Correlation at distance 2 - correlation at distance 1")
+plt.show()
+
+
 # %% Slice timing visualisations because my brain
 # is slow
 show_slice_timing(multiband_slice_timing)
@@ -115,10 +160,16 @@ plt.title("Corrected by interpolation")
 plt.show()
 
 # %% Get per centre lag distribution.
-# This is EXTREMLY slow
-
-rsfmris["lag"] = rsfmris.loc[:, "path"].map(rsfmri_lag) 
-rsfmris.to_csv("output/slice_timing/lags.csv")
+# Scans are spread over N_JOBS processes and streamed one volume
+# at a time. Lags are appended to the csv as they come, and a
+# restarted run skips the scans which are already there.
+os.makedirs("output/slice_timing", exist_ok=True)
+rsfmris = batch_lags(
+    rsfmris,
+    "output/slice_timing/lags.csv",
+    n_jobs=N_JOBS,
+    method=LAG_METHOD
+)
 
 
 # %%
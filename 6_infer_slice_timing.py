@@ -123,41 +123,36 @@ res = merged[abs(merged.lag) < 1.5].groupby("centre / machine")["lag"].median()
 res_ = res[res.values.__abs__() > 0.1]
 print(res_)
 # %%
-from scipy.stats import ttest_1samp, bootstrap
 import numpy as np
 from matplotlib.backends.backend_pdf import PdfPages
 
+from slice_timing.statistics import bootstrap_median_pvalues
 
-def is_lag_significant(
-    lag_samples:np.ndarray
-):
-    
-    res = bootstrap(
-        lag_samples.reshape(1, -1),
-        np.median,
-        n_resamples=len(lag_samples) * 10
-    )
-    _, p = ttest_1samp(res.bootstrap_distribution, 0.)
-    return p
-
+# Number of bootstrap resamples of each group,
+# None for 10 times the number of scans of the group
+N_RESAMPLES = None
 
-tests = []
 merged = merged[abs(merged.lag) < 3 / 2]
 
+# All groups are tested at once
+groups = {
+    centre_machine: lags.to_numpy()
+    for centre_machine, lags in merged.groupby("centre / machine")["lag"]
+    if len(lags) > 3
+}
+p_values = bootstrap_median_pvalues(list(groups.values()), n_resamples=N_RESAMPLES)
+tests = list(zip(groups.keys(), p_values))
+
 with PdfPages("output/slice_timing/significant_lags.pdf") as pdf:
-    for centre_machine in merged["centre / machine"].unique():
-        lags = merged[merged["centre / machine"] == centre_machine]["lag"].to_numpy()
-        if len(lags) > 3:
-            res = is_lag_significant(lags)
-            print(f"{centre_machine}, significant lag is {res}")
-            tests.append((centre_machine, res))
-            if res < 0.05:
-                sns.swarmplot(x=lags, color="red")
-                sns.boxplot(x=lags, fill=None, color="blue")
-                plt.title(f"{centre_machine}, p={res:.2f}")
-                plt.xlabel("Time (TR)")
-                pdf.savefig()
-                plt.close()
+    for (centre_machine, lags), res in zip(groups.items(), p_values):
+        print(f"{centre_machine}, significant lag is {res}")
+        if res < 0.05:
+            sns.swarmplot(x=lags, color="red")
+            sns.boxplot(x=lags, fill=None, color="blue")
+            plt.title(f"{centre_machine}, p={res:.2f}")
+            plt.xlabel("Time (TR)")
+            pdf.savefig()
+            plt.close()
 
 tests = pd.DataFrame(tests, columns=["centre / machine", "is_lag_significant"])
 tests[tests.is_lag_significant < 0.01].sort_values(by="is_lag_significant")
@@ -0,0 +1,60 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from mappings.iqms import outlier_detection
+
+# Entities of mriqc bids_name, e.g. sub-0001_ses-M000_task-rest_bold
+BIDS_NAME_PATTERN = (
+    r"^(?P<participant_id>sub-(?P<subject>[^_]+))"
+    r"(?:_ses-(?P<session>[^_]+))?"
+    r"(?:_task-(?P<task>[^_]+))?"
+    r"(?:_acq-(?P<acquisition>[^_]+))?"
+    r"(?:_run-(?P<run>[^_]+))?"
+    r"_(?P<suffix>[^_]+)$"
+)
+
+
+def load_mriqc_group(bids_path, modality="bold", iqms=outlier_detection):
+    """
+    Loads derivatives/mriqc/group_{modality}.tsv, reading only bids_name
+    and the IQMs. IQMs are float32, the entities of bids_name and the
+    centre from participants.tsv are categorical.
+    IQMs which mriqc does not compute for modality are left out.
+
+    Args:
+        bids_path (Path): Root of the BIDS dataset
+        modality (str, optional): "bold" or "T1w". Defaults to "bold".
+        iqms (list, optional): IQMs to load. Defaults to
+        mappings.iqms.outlier_detection.
+
+    Returns:
+        pd.DataFrame: bids_name, entities, centre and IQMs of the scans
+        whose participant is in participants.tsv
+    """
+    bids_path = Path(bids_path)
+    iqms = set(iqms)
+    qc = pd.read_csv(
+        bids_path / f"derivatives/mriqc/group_{modality}.tsv",
+        sep="\t",
+        usecols=lambda col: col == "bids_name" or col in iqms,
+        dtype={iqm: np.float32 for iqm in iqms}
+    )
+
+    entities = qc["bids_name"].str.extract(BIDS_NAME_PATTERN)
+    entities = entities.dropna(axis=1, how="all")
+
+    participants = pd.read_csv(
+        bids_path / "participants.tsv",
+        sep="\t",
+        usecols=["participant_id", "centre"],
+        dtype=str
+    )
+    qc = pd.concat([entities, qc], axis=1).merge(
+        participants, on="participant_id", how="inner"
+    )
+
+    categorical = list(entities.columns) + ["centre"]
+    qc[categorical] = qc[categorical].astype("category")
+    return qc
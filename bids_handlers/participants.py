@@ -0,0 +1,92 @@
+import csv
+
+import pandas as pd
+
+from utils.atomic import atomic_output
+
+
+class ParticipantRegistry(dict):
+    """
+    In-memory copy of participants.tsv, mapping each participant_id
+    to its row. The file is read once, lookups are exact, and new
+    participants are only written when write is called.
+    """
+
+    def __init__(self, *args, columns=("participant_id", "centre"), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.columns = list(columns)
+        self.path = None
+        self.pending = []
+
+    @classmethod
+    def from_path(cls, path):
+        with open(path, "r", newline="") as file:
+            reader = csv.DictReader(file, delimiter="\t")
+            rows = list(reader)
+            columns = reader.fieldnames or ("participant_id", "centre")
+
+        new_registry = cls(
+            ((row["participant_id"], row) for row in rows),
+            columns=columns
+        )
+        new_registry.path = path
+
+        return new_registry
+
+    @staticmethod
+    def participant_id(sub):
+        return sub if sub.startswith("sub-") else f"sub-{sub}"
+
+    def __contains__(self, sub):
+        return super().__contains__(self.participant_id(sub))
+
+    def add(self, sub, centre, **columns):
+        """
+        Registers a participant if it is unknown.
+
+        Returns:
+            bool: True if the participant has been added
+        """
+        participant_id = self.participant_id(sub)
+        if participant_id in self:
+            return False
+
+        self[participant_id] = {
+            "participant_id": participant_id,
+            "centre": centre,
+            **columns
+        }
+        self.pending.append(participant_id)
+        return True
+
+    def centre(self, sub):
+        return self[self.participant_id(sub)]["centre"]
+
+    def to_frame(self):
+        participants = pd.DataFrame(list(self.values()), columns=self.columns)
+        participants["subject"] = participants.participant_id.str[4:]
+        return participants
+
+    def write(self, path=None):
+        """
+        Rewrites the whole file atomically, nothing is written
+        if no participant has been added since loading.
+        """
+        path = self.path if path is None else path
+        if not self.pending and path == self.path:
+            return path
+
+        with atomic_output(path) as tmp_path:
+            with open(tmp_path, "w", newline="") as file:
+                writer = csv.DictWriter(
+                    file,
+                    fieldnames=self.columns,
+                    delimiter="\t",
+                    lineterminator="\n",
+                    extrasaction="ignore"
+                )
+                writer.writeheader()
+                writer.writerows(self.values())
+
+        self.pending = []
+        return path
@@ -0,0 +1,37 @@
+import os
+
+
+def bids_reference_path(bold_path, suffix="T1w"):
+    """
+    Path of the anatomical reference of a bold file, in the same
+    session, e.g. sub-01/ses-M000/func/sub-01_ses-M000_task-rest_bold.nii.gz
+    gives sub-01/ses-M000/anat/sub-01_ses-M000_T1w.nii.gz
+
+    Returns:
+        str: Path of the reference, None if it does not exist
+    """
+    func_dir, bold_fname = os.path.split(str(bold_path))
+    session_dir = os.path.dirname(func_dir)
+    sub, ses = bold_fname.split("_")[:2]
+    reference_path = os.path.join(
+        session_dir, "anat", f"{sub}_{ses}_{suffix}.nii.gz"
+    )
+    if os.path.isfile(reference_path):
+        return reference_path
+    return None
+
+
+def bids_entities(path):
+    """
+    Entities of a BIDS file name, e.g. sub-01_ses-M000_T1w.nii.gz
+    gives {"subject": "01", "session": "M000", "suffix": "T1w"}
+    """
+    fname = os.path.basename(str(path)).split(".")[0]
+    *pairs, suffix = fname.split("_")
+    names = {"sub": "subject", "ses": "session", "acq": "acquisition"}
+    entities = {}
+    for pair in pairs:
+        key, _, value = pair.partition("-")
+        entities[names.get(key, key)] = value
+    entities["suffix"] = suffix
+    return entities
@@ -19,4 +19,7 @@ afni = ["aor", "aqi"]
 sizes = ['size_t', 'size_x', 'size_y', 'size_z', 'spacing_tr', 'spacing_x',
        'spacing_y', 'spacing_z']
 
-ghosts = ['gsr_x', 'gsr_y']
\ No newline at end of file
+ghosts = ['gsr_x', 'gsr_y']
+
+# Avoid IQMs that discriminate on size and space
+outlier_detection = summary_bg + summary_fg + structural + afni + ghosts + fd
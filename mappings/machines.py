@@ -0,0 +1,27 @@
+import pandas as pd
+
+MONITO_SESSIONS = {
+    "Machine_M0": "M000",
+    "Machine_M24": "M024",
+    "Machine_M48": "M048"
+}
+
+
+def load_machines(monito_path):
+    """
+    Reads the cati_monito file, which tells which machine
+    was used for each scan, in long format.
+
+    Returns:
+        pd.DataFrame: subject_id, month and machine columns
+    """
+    monito = pd.read_csv(monito_path, sep="\t")
+    monito["subject_id"] = monito["NUM_ID"].str[4:]
+
+    machines = monito.melt(
+        id_vars="subject_id",
+        value_vars=list(MONITO_SESSIONS),
+        value_name="machine"
+    )
+    machines["month"] = machines["variable"].map(MONITO_SESSIONS)
+    return machines.loc[:, ["subject_id", "month", "machine"]].dropna()
@@ -1,5 +1,8 @@
 import numpy as np
 
+from utils.reductions import iter_volumes
+
+
 def efc(img, framemask=None):
     r"""
     Calculate the :abbr:`EFC (Entropy Focus Criterion)` [Atkinson1997]_.
@@ -29,18 +32,103 @@ def efc(img, framemask=None):
     """
 
     if framemask is None:
-        framemask = np.zeros_like(img, dtype=np.uint8)
+        values = np.asarray(img).ravel()
+    else:
+        values = np.asarray(img)[np.asarray(framemask) == 0]
+    work = np.empty_like(values, dtype=np.result_type(values, np.float32))
+    return float(_efc(values.size, *_efc_sums(values, work)))
+
 
-    n_vox = np.sum(1 - framemask)
-    # Calculate the maximum value of the EFC (which occurs any time all
-    # voxels have the same value)
+def _efc_sums(values, work, where=True):
+    """
+    Sums needed by the EFC of values, using work, of the shape
+    of values, as the only temporary buffer. Only the values
+    where where is True are summed.
+
+    Returns:
+        tuple: sum of x ** 2, sum of x * log(x + 1e-16) and sum of x,
+        reduced in float64
+    """
+    np.square(values, out=work, where=where)
+    energy = work.sum(dtype=np.float64, where=where)
+    np.add(values, 1e-16, out=work, where=where)
+    np.log(work, out=work, where=where)
+    np.multiply(work, values, out=work, where=where)
+    entropy = work.sum(dtype=np.float64, where=where)
+    return energy, entropy, values.sum(dtype=np.float64, where=where)
+
+
+def _efc(n_vox, energy, entropy, total):
+    # sum (x / b) * log((x + 1e-16) / b)
+    # = (sum x * log(x + 1e-16) - log(b) * sum x) / b
     efc_max = 1.0 * n_vox * (1.0 / np.sqrt(n_vox)) * np.log(1.0 / np.sqrt(n_vox))
+    b_max = np.sqrt(energy)
+    return (1.0 / efc_max) * (entropy - np.log(b_max) * total) / b_max
+
+
+class EFCAccumulator:
+    """
+    Streamed EFC of a 4D series, fed a few volumes at a time.
+    Gives the EFC of each volume and the EFC of the whole series,
+    which is what efc returns for the full 4D array.
+    The mask of the kept voxels is computed once, and a single
+    volume sized buffer is reused for all volumes.
 
-    # Calculate the total image energy
-    b_max = np.sqrt((img[framemask == 0] ** 2).sum())
+    Args:
+        framemask (np.ndarray, optional): 3D mask of empty voxels,
+        as in efc. Defaults to None.
+    """
+
+    def __init__(self, framemask=None):
+        self.keep = True if framemask is None else np.asarray(framemask) == 0
+        self._work = None
+        self.sums = []
+
+    def update(self, volumes):
+        """
+        Args:
+            volumes (np.ndarray): Chunk of shape (x, y, z, k),
+            or a single 3D volume
+        """
+        if volumes.ndim == 3:
+            volumes = volumes[..., np.newaxis]
+        if self._work is None:
+            # Volumes are summed where they are, without being flattened
+            self._work = np.empty(
+                volumes.shape[:3], np.result_type(volumes, np.float32)
+            )
+            self.n_vox = (
+                self._work.size if self.keep is True else int(self.keep.sum())
+            )
+
+        for i in range(volumes.shape[3]):
+            self.sums.append(_efc_sums(volumes[..., i], self._work, self.keep))
+
+    def series(self):
+        """EFC of each volume, of shape (t,)"""
+        return np.array([_efc(self.n_vox, *sums) for sums in self.sums])
+
+    def total(self):
+        """EFC of the whole series"""
+        energy, entropy, total = np.sum(self.sums, axis=0)
+        return float(_efc(self.n_vox * len(self.sums), energy, entropy, total))
 
-    # Calculate EFC (add 1e-16 to the image data to keep log happy)
-    return float(
-        (1.0 / efc_max)
-        * np.sum((img[framemask == 0] / b_max) * np.log((img[framemask == 0] + 1e-16) / b_max))
-    )
\ No newline at end of file
+
+def efc_series(img, framemask=None, chunk_size=16):
+    """
+    EFC of a 4D series in a single streamed pass.
+
+    Args:
+        img: Path, nibabel image or array
+        framemask (np.ndarray, optional): 3D mask of empty voxels.
+        Defaults to None.
+        chunk_size (int, optional): Number of volumes read at once.
+        Defaults to 16.
+
+    Returns:
+        tuple: EFC of the whole series and EFC of each volume
+    """
+    accumulator = EFCAccumulator(framemask)
+    for _, chunk in iter_volumes(img, chunk_size=chunk_size):
+        accumulator.update(chunk)
+    return accumulator.total(), accumulator.series()
@@ -0,0 +1,194 @@
+import warnings
+from abc import ABC, abstractmethod
+from gzip import BadGzipFile
+import zlib
+
+import numpy as np
+import nibabel as nib
+import pandas as pd
+
+from qc.efc import efc, EFCAccumulator
+from qc.scanner_space import distance_between_FOVs
+from qc.stripes import periodicity_score, stripe_profile
+from qc.sum_of_gradients import middle_gradients_qa
+from slice_timing.correlation import (
+    fft_odd_slices_lag,
+    odd_slices_lag,
+    standardize_slice_signals
+)
+from utils.reductions import bold_reductions
+from utils.signal_cache import store_slice_signals
+
+
+class Detector(ABC):
+    """
+    Base class of the detectors run by the engine.
+    start is called before reading a scan, update on each
+    chunk of volumes, and finish returns the metrics of the scan.
+    """
+
+    def start(self, img):
+        pass
+
+    def update(self, t0, chunk):
+        pass
+
+    @abstractmethod
+    def finish(self, img, reductions):
+        pass
+
+
+class GradientsDetector(Detector):
+    """Sum of gradients of the middle slices, see middle_gradients_qa"""
+
+    def finish(self, img, reductions):
+        return dict(middle_gradients_qa(reductions["mean"]))
+
+
+class StripeDetector(Detector):
+    """Periodicity score and stripe ratio of the first volumes,
+    see qc.stripes.detect_permutation"""
+
+    def __init__(self, n_volumes=16):
+        self.n_volumes = n_volumes
+
+    def start(self, img):
+        self.volumes = []
+
+    def update(self, t0, chunk):
+        if t0 < self.n_volumes:
+            self.volumes.append(chunk[..., :self.n_volumes - t0])
+
+    def finish(self, img, reductions):
+        window = np.concatenate(self.volumes, axis=3)
+        return {
+            "periodicity": periodicity_score(window.mean(axis=(0, 1))),
+            "stripe_ratio": float(np.nanmedian(stripe_profile(window)))
+        }
+
+
+class FOVDistanceDetector(Detector):
+    """
+    Distance between the FOV centres of the scan and its reference.
+
+    Args:
+        find_reference (callable): Returns the path of the reference
+        image of a scan path, or None if there is none.
+    """
+
+    def __init__(self, find_reference):
+        self.find_reference = find_reference
+
+    def finish(self, img, reductions):
+        reference_path = self.find_reference(img.get_filename())
+        if reference_path is None:
+            return {"distance_FOVs": np.nan}
+        return {
+            "distance_FOVs": distance_between_FOVs(nib.load(reference_path), img)
+        }
+
+
+class EFCDetector(Detector):
+    """EFC of the mean volume, as mriqc computes it for bold series,
+    along with the EFC of the whole series and the spread of the
+    EFC of each volume. The series of the last scan is kept in
+    self.series."""
+
+    def start(self, img):
+        self.accumulator = EFCAccumulator()
+
+    def update(self, t0, chunk):
+        self.accumulator.update(chunk)
+
+    def finish(self, img, reductions):
+        self.series = self.accumulator.series()
+        return {
+            "efc": efc(reductions["mean"]),
+            "efc_series": self.accumulator.total(),
+            "efc_volumes_std": float(self.series.std())
+        }
+
+
+class LagDetector(Detector):
+    """Lag between odd and even slices, see odd_slices_lag,
+    or fft_odd_slices_lag if method is "fft" """
+
+    def __init__(self, method="resample"):
+        self.method = method
+
+    def finish(self, img, reductions):
+        signals = standardize_slice_signals(reductions["slice_signals"])
+        if self.method == "fft":
+            return {"lag": fft_odd_slices_lag(signals)}
+        return {"lag": odd_slices_lag(signals, display=False)}
+
+
+class ThumbnailDetector(Detector):
+    """Stores the middle slices of the mean and last volumes of the
+    scan in a ThumbnailStore. It has no metric."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def finish(self, img, reductions):
+        self.store.put_reductions(img.get_filename(), reductions)
+        return {}
+
+
+def qc_scan(path, detectors, chunk_size=16):
+    """
+    Reads a scan once and returns the metrics of all detectors.
+
+    Returns:
+        dict: path and metrics of the scan
+    """
+    img = nib.load(path, keep_file_open=True)
+    for detector in detectors:
+        detector.start(img)
+
+    def update(t0, chunk):
+        for detector in detectors:
+            detector.update(t0, chunk)
+
+    # The proxy of the file opened above, so the scan is read once
+    reductions = bold_reductions(
+        img.dataobj, chunk_size=chunk_size, on_chunk=update
+    )
+    if len(img.shape) == 4:
+        # Later signal based analyses will not read the scan again
+        store_slice_signals(path, reductions["slice_signals"])
+
+    metrics = {"path": str(path)}
+    for detector in detectors:
+        metrics.update(detector.finish(img, reductions))
+    return metrics
+
+
+def run_qc(paths, detectors, output_path=None, chunk_size=16):
+    """
+    Runs all detectors over all scans, reading each scan once.
+
+    Args:
+        paths (Iterable): Paths of the scans
+        detectors (list): Detector instances
+        output_path (Path, optional): Where to write the results
+        as csv. Nothing is written if not provided.
+        chunk_size (int, optional): Number of volumes read at once.
+        Defaults to 16.
+
+    Returns:
+        pd.DataFrame: One row per scan, one column per metric
+    """
+    paths = list(paths)
+    results = []
+    for i, path in enumerate(paths):
+        print(f"{path} {i + 1}/{len(paths)}")
+        try:
+            results.append(qc_scan(path, detectors, chunk_size=chunk_size))
+        except (BadGzipFile, EOFError, zlib.error):
+            warnings.warn(f"gzip error when reading {path}, skipping scan")
+
+    df = pd.DataFrame(results)
+    if output_path is not None:
+        df.to_csv(output_path)
+    return df
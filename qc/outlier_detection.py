@@ -1,4 +1,16 @@
+import os
+
+import joblib
 import numpy as np
+import pandas as pd
+from sklearn.decomposition import PCA
+from sklearn.ensemble import IsolationForest
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from mappings.iqms import outlier_detection as IQM_COLUMNS
+from utils.atomic import atomic_output
+
 
 def spline_curvature(f, x):
 
@@ -9,4 +21,95 @@ def curvature(y):
     y_prime = y[1:] - y[:-1]
     y_pp = y_prime[1:] - y_prime[:-1]
 
-    return y_pp / ((1 + np.square(y_prime[:-1]))**(1.5))
\ No newline at end of file
+    return y_pp / ((1 + np.square(y_prime[:-1]))**(1.5))
+
+
+def fit_iqm_model(qc, model_path, columns=IQM_COLUMNS, n_components=15, n_jobs=-1):
+    """
+    Fits StandardScaler, PCA and IsolationForest on the IQMs of qc
+    and saves the fitted pipeline with joblib, along with the IQM
+    columns and the range of the training scores.
+
+    Args:
+        qc (pd.DataFrame): mriqc group table
+        model_path (Path): Where to save the model
+        columns (list, optional): IQMs used by the model.
+        Defaults to mappings.iqms.outlier_detection.
+        n_components (int, optional): Defaults to 15.
+        n_jobs (int, optional): Number of jobs of the forest.
+        Defaults to -1, all cores.
+
+    Returns:
+        dict: pipeline, columns, score_min and score_max
+    """
+    X = qc.loc[:, columns]
+    pipe = Pipeline(
+        [
+            ("scaler", StandardScaler()),
+            ("pca", PCA(n_components=n_components)),
+            ("clf", IsolationForest(random_state=1234, n_jobs=n_jobs))
+        ]
+    )
+    pipe.fit(X)
+    scores = pipe.decision_function(X)
+    model = {
+        "pipeline": pipe,
+        "columns": list(columns),
+        "score_min": float(scores.min()),
+        "score_max": float(scores.max())
+    }
+    with atomic_output(model_path) as tmp_path:
+        joblib.dump(model, tmp_path)
+    return model
+
+
+def load_iqm_model(model_path):
+    return joblib.load(model_path)
+
+
+def quality_score(model, scores):
+    """
+    Maps decision function scores to [0, 1] using the range of the
+    training scores, so that scores of new scans are comparable.
+    New scans which are worse than all training scans get negative scores.
+    """
+    score_min, score_max = model["score_min"], model["score_max"]
+    return 1 - (score_max - scores) / (score_max - score_min)
+
+
+def score_new_scans(model, qc, scores_path):
+    """
+    Scores the scans of qc whose bids_name is not in scores_path yet,
+    and appends them to scores_path.
+
+    Args:
+        model (dict): Returned by fit_iqm_model or load_iqm_model
+        qc (pd.DataFrame): mriqc group table, with a bids_name column
+        scores_path (Path): csv of the scans already scored
+
+    Returns:
+        pd.DataFrame: bids_name, score and quality_score of all
+        the scans of scores_path
+    """
+    if os.path.isfile(scores_path):
+        known = pd.read_csv(scores_path)
+    else:
+        known = pd.DataFrame(columns=["bids_name", "score", "quality_score"])
+
+    new = qc[~qc.bids_name.isin(known.bids_name)].drop_duplicates("bids_name")
+    if len(new) == 0:
+        return known
+
+    scores = model["pipeline"].decision_function(new.loc[:, model["columns"]])
+    new_scores = pd.DataFrame({
+        "bids_name": new.bids_name.to_numpy(),
+        "score": scores,
+        "quality_score": quality_score(model, scores)
+    })
+    new_scores.to_csv(
+        scores_path,
+        mode="a",
+        header=not os.path.isfile(scores_path),
+        index=False
+    )
+    return pd.concat([known, new_scores], ignore_index=True)
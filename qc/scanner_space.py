@@ -1,7 +1,11 @@
 from scipy.spatial import distance
+import numpy as np
 import nibabel as nib
+import pandas as pd
 from nibabel.affines import apply_affine
 
+from utils.sequence_report import read_nifti_headers
+
 
 def image_centre(img):
     if img.ndim == 4:
@@ -22,4 +26,74 @@ def distance_between_FOVs(
         epi_img.affine,
         image_centre(epi_img)
     )
-    return distance.euclidean(ref_centre_scanner, epi_centre_scanner)
\ No newline at end of file
+    return distance.euclidean(ref_centre_scanner, epi_centre_scanner)
+
+def fov_centres(affines, shapes):
+    """
+    Vectorized image_centre followed by apply_affine.
+
+    Args:
+        affines (np.ndarray): Affines of shape (n, 4, 4)
+        shapes (np.ndarray): Image shapes of shape (n, 3) or more
+
+    Returns:
+        np.ndarray: FOV centres in scanner space, of shape (n, 3)
+    """
+    centres = np.asarray(shapes, dtype=float)[:, :3] / 2
+    return np.einsum("nij,nj->ni", affines[:, :3, :3], centres) + affines[:, :3, 3]
+
+
+def bulk_distance_between_FOVs(pairs, n_threads=16):
+    """
+    distance_between_FOVs for many (epi, reference) pairs, only
+    reading headers. All affines are stacked and the distances
+    are computed at once.
+
+    Args:
+        pairs (Iterable): (epi_path, reference_path) tuples,
+        reference_path can be None
+        n_threads (int, optional): Number of headers read at the same
+        time. Defaults to 16.
+
+    Returns:
+        pd.DataFrame: epi and reference paths, orientation codes
+        and distance between FOV centres in mm
+    """
+    pairs = [
+        (epi_path, reference_path) for epi_path, reference_path in pairs
+    ]
+    has_reference = np.array([ref is not None for _, ref in pairs], dtype=bool)
+    epi_headers = read_nifti_headers(
+        [epi for epi, _ in pairs], n_threads=n_threads
+    )
+    reference_headers = read_nifti_headers(
+        [ref for _, ref in pairs if ref is not None], n_threads=n_threads
+    )
+
+    def stack(headers):
+        affines = np.array([hdr.get_best_affine() for hdr in headers]).reshape(-1, 4, 4)
+        shapes = np.array([hdr["dim"][1:4] for hdr in headers]).reshape(-1, 3)
+        return affines, shapes
+
+    epi_affines, epi_shapes = stack(epi_headers)
+    ref_affines, ref_shapes = stack(reference_headers)
+
+    distances = np.full(len(pairs), np.nan)
+    distances[has_reference] = np.linalg.norm(
+        fov_centres(epi_affines[has_reference], epi_shapes[has_reference])
+        - fov_centres(ref_affines, ref_shapes),
+        axis=1
+    )
+
+    reference_orientations = iter(
+        "".join(nib.aff2axcodes(affine)) for affine in ref_affines
+    )
+    return pd.DataFrame({
+        "epi_path": [str(epi) for epi, _ in pairs],
+        "reference_path": [ref and str(ref) for _, ref in pairs],
+        "epi_orientation": ["".join(nib.aff2axcodes(aff)) for aff in epi_affines],
+        "reference_orientation": [
+            next(reference_orientations) if ref else None for ref in has_reference
+        ],
+        "distance_FOVs": distances
+    })
@@ -0,0 +1,106 @@
+import numpy as np
+
+from utils.reductions import iter_volumes
+
+
+def periodicity_score(slice_means):
+    """Fraction of the power of the slice-major signal found
+    at the harmonics of 1/z. Volumes of a normal series repeat
+    the same profile along z, so the score is close to 1.
+    In a permuted series, z holds consecutive time points of
+    a single slice, and this period-z pattern disappears.
+
+    Args:
+        slice_means (np.ndarray): Mean of each slice, of shape (z, volumes)
+
+    Returns:
+        float: Score between 0 and 1
+    """
+    n_volumes = slice_means.shape[1]
+    series = slice_means.T.ravel()
+    power = np.abs(np.fft.rfft(series - series.mean())) ** 2
+    total = power[1:].sum()
+    if total == 0:
+        return np.nan
+    # With n_volumes periods, harmonics of 1/z fall every n_volumes bins
+    return float(power[n_volumes::n_volumes].sum() / total)
+
+
+def stripe_profile(window):
+    """Gradient along z relative to in-plane gradients, for each
+    pair of neighbouring slices. Low values mean that neighbouring
+    slices hold the same image, as in permuted brains.
+
+    Args:
+        window (np.ndarray): Volumes of shape (x, y, z, k)
+
+    Returns:
+        np.ndarray: Ratios of shape (z - 1,)
+    """
+    through_plane = abs(np.diff(window, axis=2)).mean(axis=(0, 1, 3))
+    in_plane = (
+        abs(np.diff(window, axis=0)).mean(axis=(0, 1, 3))
+        + abs(np.diff(window, axis=1)).mean(axis=(0, 1, 3))
+    ) / 2
+    in_plane = (in_plane[:-1] + in_plane[1:]) / 2
+    return np.divide(
+        through_plane,
+        in_plane,
+        out=np.full_like(through_plane, np.nan),
+        where=in_plane > 0
+    )
+
+
+def detect_permutation(
+    img,
+    start=0,
+    min_volumes=4,
+    max_volumes=16,
+    threshold=0.5,
+    margin=0.25
+):
+    """Screens a bold series for permuted voxels by reading a few
+    volumes only. Volumes are read one at a time from start, and
+    reading stops as soon as the periodicity score is clearly on
+    one side of the threshold.
+
+    Args:
+        img: Path, nibabel image or array
+        start (int, optional): First volume read. Defaults to 0.
+        min_volumes (int, optional): Volumes read before deciding.
+        Defaults to 4.
+        max_volumes (int, optional): Maximum number of volumes read.
+        Defaults to 16.
+        threshold (float, optional): Series with a periodicity score
+        below are flagged. Defaults to 0.5.
+        margin (float, optional): Distance to the threshold at which
+        the evidence is considered clear. Defaults to 0.25.
+
+    Returns:
+        dict: permuted flag, periodicity score, median stripe ratio,
+        stripe profile along z and number of volumes read
+    """
+    volumes = []
+    for _, chunk in iter_volumes(
+        img, chunk_size=1, start=start, stop=start + max_volumes
+    ):
+        volumes.append(chunk)
+        if len(volumes) < min_volumes:
+            continue
+        score = periodicity_score(
+            np.concatenate(volumes, axis=3).mean(axis=(0, 1))
+        )
+        if abs(score - threshold) > margin:
+            break
+
+    window = np.concatenate(volumes, axis=3)
+    score = periodicity_score(window.mean(axis=(0, 1)))
+    profile = stripe_profile(window)
+
+    return {
+        "permuted": bool(score < threshold),
+        "periodicity": score,
+        "stripe_ratio": float(np.nanmedian(profile)),
+        "stripe_profile": profile,
+        "n_volumes": window.shape[3]
+    }
@@ -0,0 +1,111 @@
+import os
+import warnings
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from gzip import BadGzipFile
+
+import numpy as np
+import pandas as pd
+
+from slice_timing.correlation import (
+    fft_odd_slices_lag,
+    odd_slices_lag,
+    standardize_slice_signals
+)
+from utils.signal_cache import cached_slice_signals
+
+
+def scan_lag(path, chunk_size=1, method="resample"):
+    """
+    Same as rsfmri_lag, reading chunk_size volumes at a time
+    when the slice signals are not in the derivative cache.
+    Unreadable scans get a nan lag instead of raising.
+    """
+    try:
+        signals = cached_slice_signals(path, chunk_size=chunk_size)
+    except (BadGzipFile, EOFError, zlib.error):
+        warnings.warn(f"gzip error when reading {path}, lag set to nan")
+        return np.nan
+    signals = standardize_slice_signals(signals)
+    if method == "fft":
+        return fft_odd_slices_lag(signals)
+    return odd_slices_lag(signals, display=False)
+
+
+def _complete_size(path):
+    # Size of the file up to its last newline, the end of
+    # a line being cut if the writer was killed
+    size = 0
+    with open(path, "rb") as file:
+        for line in file:
+            if not line.endswith(b"\n"):
+                break
+            size += len(line)
+    return size
+
+
+def batch_lags(
+    rsfmris,
+    output_path,
+    n_jobs=1,
+    chunk_size=1,
+    method="resample",
+    verbose=False
+):
+    """
+    Computes the odd/even slices lag of many scans over a process pool.
+    Each row of rsfmris is appended to output_path with its lag as soon
+    as it is computed, and flushed to disk. The scans already in
+    output_path are skipped, so an interrupted run resumes where it
+    stopped, after dropping the row it was writing, if any.
+
+    Args:
+        rsfmris (pd.DataFrame): One row per scan, with a path column.
+        All the columns are written along with the lag.
+        output_path (Path): csv of the lags, read with index_col=0
+        n_jobs (int, optional): Number of scans processed at the same
+        time. Defaults to 1.
+        chunk_size (int, optional): Number of volumes in memory
+        for each scan. Defaults to 1.
+        method (str, optional): "resample" or "fft", see rsfmri_lag.
+        Defaults to "resample".
+        verbose (bool, optional): Print the lag of each scan.
+        Defaults to False.
+
+    Returns:
+        pd.DataFrame: Content of output_path
+    """
+    output = open(output_path, "a")
+    try:
+        output.truncate(_complete_size(output_path))
+        write_header = os.path.getsize(output_path) == 0
+        if not write_header:
+            done = pd.read_csv(output_path, usecols=["path"])
+            rsfmris = rsfmris[~rsfmris.path.isin(done.path)]
+
+        compute_lag = partial(scan_lag, chunk_size=chunk_size, method=method)
+        pool = None
+        if n_jobs > 1:
+            pool = ProcessPoolExecutor(max_workers=n_jobs)
+            lags = pool.map(compute_lag, rsfmris.path)
+        else:
+            lags = map(compute_lag, rsfmris.path)
+
+        try:
+            for (idx, row), lag in zip(rsfmris.iterrows(), lags):
+                if verbose:
+                    print(f"{row.path} lag = {lag}")
+                pd.DataFrame([row], index=[idx]).assign(lag=lag).to_csv(
+                    output, header=write_header
+                )
+                write_header = False
+                output.flush()
+                os.fsync(output.fileno())
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+    finally:
+        output.close()
+
+    return pd.read_csv(output_path, index_col=0)
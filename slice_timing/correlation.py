@@ -1,15 +1,128 @@
-from scipy import signal
+import os
+
+from scipy import fft, signal
 import numpy as np
-import nibabel as nib
 import matplotlib.pyplot as plt
 
-def make_slice_corr_map(sequence_array):
-    slice_signals = signal.detrend(sequence_array.mean(axis=(0, 1)), axis=1)
+from utils.reductions import slice_signals as compute_slice_signals
+from utils.signal_cache import cached_slice_signals
+
+def standardize_slice_signals(slice_signals):
+    """Detrends and zscores slice signals of shape (slice, time)"""
+    slice_signals = signal.detrend(slice_signals, axis=1)
     mat = slice_signals - slice_signals.mean(axis=1).reshape((len(slice_signals), 1))
     mat /= mat.std(axis=1).reshape((len(mat), 1))
-    corr_map = mat @ mat.T / slice_signals.shape[1]
+    return mat
+
+def make_slice_corr_map(sequence_array):
+    """
+    Args:
+        sequence_array: 4D array, nibabel image or path.
+        Images are streamed, and never fully loaded. Slice
+        signals of paths are read from the derivative cache.
+    """
+    if isinstance(sequence_array, (str, os.PathLike)):
+        slice_signals = cached_slice_signals(sequence_array)
+    else:
+        slice_signals = compute_slice_signals(sequence_array)
+    mat = standardize_slice_signals(slice_signals)
+    corr_map = mat @ mat.T / mat.shape[1]
     return mat, corr_map
 
+def stack_slice_signals(slice_signals_list):
+    """
+    Stacks slice signals of several scans. Scans with fewer slices
+    are padded with nan slices, and shorter series are padded with
+    nan time points at their end.
+
+    Args:
+        slice_signals_list (list): Arrays of shape (slice, time)
+
+    Returns:
+        np.ndarray: Array of shape (scan, slice, time)
+    """
+    n_slices = max(len(signals) for signals in slice_signals_list)
+    n_TR = max(signals.shape[1] for signals in slice_signals_list)
+    stack = np.full((len(slice_signals_list), n_slices, n_TR), np.nan)
+    for i, signals in enumerate(slice_signals_list):
+        stack[i, :len(signals), :signals.shape[1]] = signals
+    return stack
+
+
+def series_lengths(stack):
+    """Number of time points of each scan of a stack, padding excluded"""
+    return np.sum(~np.isnan(stack).all(axis=1), axis=-1)
+
+
+def standardize_slice_stack(stack):
+    """
+    standardize_slice_signals of all the scans of a stack at once.
+    The linear trend is removed by least squares with a single
+    pseudo-inverse for all the scans of the same length, each scan
+    being standardized over its own time points. nan slices and
+    nan padding stay nan.
+    """
+    lengths = series_lengths(stack)
+    mat = np.full_like(stack, np.nan)
+    for n_TR in np.unique(lengths):
+        members = np.flatnonzero(lengths == n_TR)
+        series = stack[members, :, :n_TR]
+        design = np.stack([np.arange(n_TR, dtype=float), np.ones(n_TR)], axis=1)
+        series = series - (series @ np.linalg.pinv(design).T) @ design.T
+        series -= series.mean(axis=-1, keepdims=True)
+        series /= series.std(axis=-1, keepdims=True)
+        mat[members, :, :n_TR] = series
+    return mat
+
+
+class SliceCorrelationMaps:
+    """
+    Standardized slice signals of many scans. The correlation maps
+    are only computed, with a single batched matmul, when maps
+    is accessed for the first time. The map of each scan is the
+    one of make_slice_corr_map, whatever the other scans are.
+
+    Args:
+        slice_signals_list (list): Arrays of shape (slice, time),
+        see stack_slice_signals
+    """
+
+    def __init__(self, slice_signals_list):
+        self.signals = standardize_slice_stack(
+            stack_slice_signals(slice_signals_list)
+        )
+        self.lengths = series_lengths(self.signals)
+        self._maps = None
+
+    @property
+    def maps(self):
+        """Correlation maps of shape (scan, slice, slice)"""
+        if self._maps is None:
+            # Padding adds nothing to the products, nan slices
+            # are put back once the products are done
+            signals = np.nan_to_num(self.signals)
+            maps = np.matmul(signals, signals.transpose(0, 2, 1))
+            maps /= self.lengths[:, np.newaxis, np.newaxis]
+            missing = np.isnan(self.signals).all(axis=-1)
+            maps[missing[:, :, np.newaxis] | missing[:, np.newaxis, :]] = np.nan
+            self._maps = maps
+        return self._maps
+
+    def neighbour_correlation(self, distance=1):
+        """
+        Mean correlation between slices which are distance slices
+        apart, for each scan. Interleaved acquisitions correlate
+        more at distance 2 than at distance 1.
+
+        Returns:
+            np.ndarray: Array of shape (scan,)
+        """
+        return np.nanmean(
+            np.diagonal(self.maps, offset=distance, axis1=1, axis2=2),
+            axis=-1
+        )
+
+
 # Too much responsability on this 
 # poor function
 def odd_slices_lag(
@@ -91,8 +204,64 @@ def odd_slices_lag(
 
     return tau_opt / os_factor
 
-def rsfmri_lag(rsfmri_path, display=False):
-    img = nib.load(rsfmri_path).get_fdata()
-    # TODO We don't need to compute the matrix
-    signals, _ = make_slice_corr_map(img)
+def fft_odd_slices_lag(signals, refinement="phase", max_lag=None):
+    """Lag between odd and even slices, with the convention
+    of odd_slices_lag, without oversampling nor plotting.
+    The mean even and odd signals are cross correlated at the
+    original rate in the frequency domain, and the integer
+    peak is refined below the TR.
+
+    Args:
+        signals (np.ndarray): Array of zcored and detrended
+        signals, of shape (slice, time)
+        refinement (str, optional): "phase" fits the slope of
+        the phase of the cross spectrum, "parabolic" fits a parabola
+        on the peak and its neighbours. Defaults to "phase".
+        max_lag (int, optional): Largest lag searched, in TR.
+        Defaults to half the number of TRs, as in odd_slices_lag.
+
+    Returns:
+        float: Lag in TR
+    """
+    even_signal = signals[::2].mean(axis=0)
+    odd_signal = signals[1::2].mean(axis=0)
+    n_TR = len(even_signal)
+    if max_lag is None:
+        max_lag = n_TR // 2
+
+    # Same as signal.correlate(even_signal, odd_signal), zero padding
+    # makes the circular correlation a linear one
+    n_fft = fft.next_fast_len(2 * n_TR - 1, real=True)
+    cross_spectrum = fft.rfft(even_signal, n_fft) * np.conj(fft.rfft(odd_signal, n_fft))
+    corr = fft.irfft(cross_spectrum, n_fft)
+
+    lags = np.r_[0:max_lag + 1, -max_lag:0]
+    tau = lags[np.argmax(corr[lags])]
+
+    if refinement == "parabolic":
+        before, peak, after = corr[tau - 1], corr[tau], corr[(tau + 1) % n_fft]
+        curvature = before - 2 * peak + after
+        delta = 0.5 * (before - after) / curvature if curvature != 0 else 0.
+    elif refinement == "phase":
+        # Once the integer lag is removed, the phase of the cross
+        # spectrum is -omega * delta, fitted by weighted least squares
+        omega = 2 * np.pi * np.arange(1, len(cross_spectrum)) / n_fft
+        residual = cross_spectrum[1:] * np.exp(1j * omega * tau)
+        weights = np.abs(residual)
+        delta = -np.sum(weights * omega * np.angle(residual)) / np.sum(weights * omega ** 2)
+    else:
+        raise ValueError(f"Unknown refinement {refinement}")
+
+    return float(tau + delta)
+
+
+def rsfmri_lag(rsfmri_path, display=False, method="resample"):
+    """
+    Args:
+        method (str, optional): "resample" for odd_slices_lag,
+        "fft" for fft_odd_slices_lag. Defaults to "resample".
+    """
+    signals = standardize_slice_signals(cached_slice_signals(rsfmri_path))
+    if method == "fft":
+        return fft_odd_slices_lag(signals)
     return odd_slices_lag(signals, display=display)
\ No newline at end of file
@@ -0,0 +1,123 @@
+import numpy as np
+from scipy import stats
+
+
+def pad_groups(groups):
+    """
+    Stacks samples of different sizes into a nan padded array.
+
+    Args:
+        groups (list): 1D arrays
+
+    Returns:
+        tuple: padded array of shape (group, max size) and sizes
+    """
+    sizes = np.array([len(group) for group in groups])
+    padded = np.full((len(groups), sizes.max()), np.nan)
+    for i, group in enumerate(groups):
+        padded[i, :len(group)] = group
+    return padded, sizes
+
+
+def _padded_median(samples, sizes):
+    # nan are sorted last, so the values of each group come first
+    samples = np.sort(samples, axis=-1)
+    low = np.expand_dims((sizes - 1) // 2, axis=(1, 2))
+    high = np.expand_dims(sizes // 2, axis=(1, 2))
+    return (
+        np.take_along_axis(samples, low, axis=-1)
+        + np.take_along_axis(samples, high, axis=-1)
+    )[..., 0] / 2
+
+
+def _bootstrap_medians(groups, n_resamples, batch_size, rng):
+    padded, sizes = pad_groups(groups)
+    n_groups, max_size = padded.shape
+    # Draws past the size of a group are not part of its resample
+    outside = np.arange(max_size) >= sizes[:, np.newaxis, np.newaxis]
+
+    medians = np.empty((n_groups, n_resamples))
+    for start in range(0, n_resamples, batch_size):
+        n_batch = min(batch_size, n_resamples - start)
+        u = rng.random((n_groups, n_batch, max_size))
+        indices = (u * sizes[:, np.newaxis, np.newaxis]).astype(int)
+        samples = np.take_along_axis(padded[:, np.newaxis, :], indices, axis=-1)
+        samples[np.broadcast_to(outside, samples.shape)] = np.nan
+        medians[:, start:start + n_batch] = _padded_median(samples, sizes)
+    return medians
+
+
+def grouped_bootstrap_medians(
+    groups,
+    n_resamples,
+    batch_size=256,
+    seed=None
+):
+    """
+    Bootstrap distributions of the median of all groups at once.
+    Resamples of group g take floor(u * n_g) as indices, with u
+    uniform in [0, 1), so groups are drawn together from one random
+    array. Groups are padded with nan to the size of the largest one,
+    after being binned by size so that padding at most doubles
+    the work.
+
+    Args:
+        groups (list): 1D arrays of samples
+        n_resamples (int or np.ndarray): Number of resamples,
+        the same for all groups or one per group
+        batch_size (int, optional): Number of resamples drawn at once,
+        to bound memory. Defaults to 256.
+        seed (int, optional): Seed of the random generator.
+
+    Returns:
+        np.ndarray: Medians of shape (group, max n_resamples), nan past
+        the number of resamples of each group
+    """
+    sizes = np.array([len(group) for group in groups])
+    n_resamples = np.broadcast_to(n_resamples, sizes.shape)
+    rng = np.random.default_rng(seed)
+
+    medians = np.full((len(groups), n_resamples.max()), np.nan)
+    size_bins = np.ceil(np.log2(sizes)).astype(int)
+    for size_bin in np.unique(size_bins):
+        members = np.flatnonzero(size_bins == size_bin)
+        n_bin_resamples = n_resamples[members].max()
+        medians[members, :n_bin_resamples] = _bootstrap_medians(
+            [groups[i] for i in members], n_bin_resamples, batch_size, rng
+        )
+
+    medians[np.arange(n_resamples.max()) >= n_resamples[:, np.newaxis]] = np.nan
+    return medians
+
+
+def bootstrap_median_pvalues(
+    groups,
+    n_resamples=None,
+    batch_size=256,
+    seed=None
+):
+    """
+    For each group, one sample t-test of the bootstrap distribution
+    of the median against 0, as is_lag_significant did for one group.
+
+    Args:
+        groups (list): 1D arrays of samples
+        n_resamples (int or np.ndarray, optional): Number of resamples.
+        Defaults to 10 times the size of each group.
+        batch_size (int, optional): Defaults to 256.
+        seed (int, optional): Seed of the random generator.
+
+    Returns:
+        np.ndarray: p-values of shape (group,)
+    """
+    if n_resamples is None:
+        n_resamples = 10 * np.array([len(group) for group in groups])
+    medians = grouped_bootstrap_medians(groups, n_resamples, batch_size, seed)
+
+    # ttest_1samp along axis 1, ignoring the nan padding
+    n = np.sum(~np.isnan(medians), axis=1)
+    mean = np.nanmean(medians, axis=1)
+    sem = np.nanstd(medians, axis=1, ddof=1) / np.sqrt(n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = mean / sem
+    return 2 * stats.t.sf(np.abs(t), n - 1)
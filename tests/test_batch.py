@@ -0,0 +1,29 @@
+import pandas as pd
+
+from slice_timing import batch
+
+
+def test_batch_lags_resumes_after_a_cut_row(tmp_path, monkeypatch):
+    computed = []
+
+    def scan_lag(path, chunk_size=1, method="resample"):
+        computed.append(path)
+        return int(path[4:]) / 2
+
+    monkeypatch.setattr(batch, "scan_lag", scan_lag)
+    rsfmris = pd.DataFrame(
+        {"path": [f"scan{i}" for i in range(5)], "site": list("abcde")},
+        index=range(10, 15)
+    )
+    output_path = tmp_path / "lags.csv"
+
+    batch.batch_lags(rsfmris.iloc[:3], output_path)
+    # Row of a run killed while writing
+    with open(output_path, "a") as file:
+        file.write("13,scan3,d,1.")
+    lags = batch.batch_lags(rsfmris, output_path)
+
+    assert computed == [f"scan{i}" for i in range(5)]
+    pd.testing.assert_frame_equal(
+        lags, rsfmris.assign(lag=[0, 0.5, 1, 1.5, 2])
+    )
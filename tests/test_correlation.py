@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from slice_timing.correlation import (
+    fft_odd_slices_lag,
+    odd_slices_lag,
+    SliceCorrelationMaps,
+    standardize_slice_signals
+)
+
+
+def delayed_signals(lag, n_TR=200, n_slices=8):
+    # Gaussian pulse, the odd slices seeing it lag TR earlier
+    t = np.arange(n_TR, dtype=float)
+    even = np.exp(-(t - n_TR / 2) ** 2 / 50)
+    odd = np.exp(-(t + lag - n_TR / 2) ** 2 / 50)
+    return np.array([even, odd] * (n_slices // 2))
+
+
+@pytest.mark.parametrize("lag", [0, 3, -2, 0.4, -1.7, 2.25])
+def test_fft_lag_of_an_analytic_delay(lag):
+    signals = delayed_signals(lag)
+    assert fft_odd_slices_lag(signals) == pytest.approx(lag, abs=1e-6)
+    assert fft_odd_slices_lag(signals, "parabolic") == pytest.approx(lag, abs=0.01)
+
+
+@pytest.mark.parametrize("lag", [3, -2, 0.4])
+def test_fft_lag_has_the_sign_of_odd_slices_lag(lag):
+    signals = delayed_signals(lag)
+    assert fft_odd_slices_lag(signals) == pytest.approx(
+        odd_slices_lag(signals, display=False), abs=0.05
+    )
+
+
+
+def test_batched_maps_equal_per_scan_maps():
+    rng = np.random.default_rng(0)
+    # Scans of different lengths and numbers of slices
+    slice_signals_list = [
+        rng.normal(size=(6, 40)),
+        rng.normal(size=(6, 25)) + np.arange(25),
+        rng.normal(size=(4, 40)),
+        rng.normal(size=(5, 31)),
+    ]
+    corr_maps = SliceCorrelationMaps(slice_signals_list)
+    np.testing.assert_array_equal(corr_maps.lengths, [40, 25, 40, 31])
+
+    for slice_signals, batched_map in zip(slice_signals_list, corr_maps.maps):
+        n_slices = len(slice_signals)
+        single_map = SliceCorrelationMaps([slice_signals]).maps[0]
+        np.testing.assert_allclose(
+            batched_map[:n_slices, :n_slices], single_map, atol=1e-12
+        )
+        # Same as make_slice_corr_map, without its float32 reduction
+        mat = standardize_slice_signals(slice_signals)
+        np.testing.assert_allclose(
+            single_map, mat @ mat.T / mat.shape[1], atol=1e-12
+        )
+        assert np.isnan(batched_map[n_slices:]).all()
+        assert np.isnan(batched_map[:, n_slices:]).all()
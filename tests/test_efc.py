@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from qc.efc import efc, efc_series, EFCAccumulator
+
+
+def reference_efc(img, framemask=None):
+    # mriqc implementation, before the streamed rewrite
+    if framemask is None:
+        framemask = np.zeros_like(img, dtype=np.uint8)
+    n_vox = np.sum(1 - framemask)
+    efc_max = 1.0 * n_vox * (1.0 / np.sqrt(n_vox)) * np.log(1.0 / np.sqrt(n_vox))
+    b_max = np.sqrt((img[framemask == 0] ** 2).sum())
+    return (1.0 / efc_max) * np.sum(
+        (img[framemask == 0] / b_max)
+        * np.log((img[framemask == 0] + 1e-16) / b_max)
+    )
+
+
+@pytest.fixture
+def series():
+    rng = np.random.default_rng(0)
+    return rng.gamma(2.0, 100.0, size=(10, 9, 8, 13))
+
+
+@pytest.fixture
+def framemask():
+    framemask = np.zeros((10, 9, 8), dtype=np.uint8)
+    framemask[:2] = 1
+    framemask[..., -1] = 1
+    return framemask
+
+
+def test_efc_matches_reference(series, framemask):
+    volume = series.mean(axis=3)
+    assert efc(volume) == pytest.approx(reference_efc(volume), rel=1e-6)
+    assert efc(volume, framemask) == pytest.approx(
+        reference_efc(volume, framemask), rel=1e-6
+    )
+
+
+def test_efc_series_matches_reference(series, framemask):
+    total, per_volume = efc_series(series, chunk_size=4)
+    assert total == pytest.approx(reference_efc(series), rel=1e-6)
+    np.testing.assert_allclose(
+        per_volume,
+        [reference_efc(series[..., t]) for t in range(series.shape[3])],
+        rtol=1e-6
+    )
+
+    mask_4d = np.broadcast_to(framemask[..., np.newaxis], series.shape)
+    total, per_volume = efc_series(series, framemask, chunk_size=5)
+    assert total == pytest.approx(reference_efc(series, mask_4d), rel=1e-6)
+    np.testing.assert_allclose(
+        per_volume,
+        [reference_efc(series[..., t], framemask) for t in range(series.shape[3])],
+        rtol=1e-6
+    )
+
+
+def test_accumulator_of_fortran_ordered_volumes(series, framemask):
+    accumulator = EFCAccumulator(framemask)
+    accumulator.update(np.asfortranarray(series))
+    np.testing.assert_allclose(
+        accumulator.series(),
+        [reference_efc(series[..., t], framemask) for t in range(series.shape[3])],
+        rtol=1e-6
+    )
@@ -0,0 +1,42 @@
+import re
+import zlib
+
+import numpy as np
+
+from utils.image_pdf import encode_page, ImagePdf
+
+
+def test_pages_and_cross_references(tmp_path):
+    rng = np.random.default_rng(0)
+    images = [
+        rng.integers(0, 256, size=shape, dtype=np.uint8)
+        for shape in [(30, 40, 4), (50, 20, 4)]
+    ]
+    pdf_path = tmp_path / "pages.pdf"
+    with ImagePdf(pdf_path) as pdf:
+        for image in images:
+            pdf.add_page(*encode_page(image, dpi=72))
+    content = pdf_path.read_bytes()
+
+    assert content.startswith(b"%PDF-1.4")
+    assert b"/Count 2" in content
+    assert re.findall(rb"/MediaBox \[0 0 ([\d.]+) ([\d.]+)\]", content) == [
+        (b"40.000", b"30.000"), (b"20.000", b"50.000")
+    ]
+
+    # Every object is where the cross-reference table says
+    xref = int(re.search(rb"startxref\n(\d+)", content).group(1))
+    table = content[xref:].split(b"trailer")[0].splitlines()[3:]
+    for number, entry in enumerate(table, start=1):
+        offset = int(entry[:10])
+        assert content[offset:].startswith(f"{number} 0 obj".encode())
+
+    # Images are stored as RGB rows, the alpha channel dropped
+    streams = re.findall(rb"/Subtype /Image.*?stream\n", content, re.S)
+    assert len(streams) == len(images)
+    start = content.index(streams[0]) + len(streams[0])
+    length = int(re.search(rb"/Length (\d+)", streams[0]).group(1))
+    np.testing.assert_array_equal(
+        np.frombuffer(zlib.decompress(content[start:start + length]), np.uint8),
+        images[0][..., :3].ravel()
+    )
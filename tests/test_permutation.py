@@ -0,0 +1,63 @@
+import numpy as np
+import nibabel as nib
+import pytest
+
+from transformations.legacy_unstripe import destripe_img_old
+from transformations.permutation import destripe_img, repair_scan
+
+
+def test_destripe_img_matches_legacy(capsys):
+    bad_arr = np.random.default_rng(0).normal(size=(3, 4, 7, 30))
+    bad_arr = bad_arr.astype(np.float32)
+    expected = destripe_img_old(bad_arr)
+    capsys.readouterr()
+
+    new_arr = destripe_img(bad_arr)
+    assert new_arr.dtype == expected.dtype
+    np.testing.assert_array_equal(new_arr, expected)
+
+
+def test_repair_scan_matches_destripe_img(tmp_path):
+    bad_arr = np.random.default_rng(1).normal(size=(5, 6, 7, 23))
+    bad_arr = bad_arr.astype(np.float32)
+    bad_path = tmp_path / "bad.nii.gz"
+    nib.save(nib.Nifti1Image(bad_arr, np.eye(4)), bad_path)
+
+    # chunk_size does not divide the number of volumes
+    repair_scan(bad_path, tmp_path / "new.nii.gz", chunk_size=4)
+    new_img = nib.load(tmp_path / "new.nii.gz")
+    assert new_img.get_data_dtype() == np.float32
+    np.testing.assert_array_equal(new_img.get_fdata(), destripe_img(bad_arr))
+
+
+def test_repair_scan_in_place(tmp_path):
+    bad_arr = np.random.default_rng(2).normal(size=(4, 4, 6, 10))
+    bad_arr = bad_arr.astype(np.float32)
+    bad_path = tmp_path / "bad.nii.gz"
+    nib.save(nib.Nifti1Image(bad_arr, np.eye(4)), bad_path)
+
+    repair_scan(bad_path, bad_path)
+    np.testing.assert_array_equal(
+        nib.load(bad_path).get_fdata(), destripe_img(bad_arr)
+    )
+
+
+@pytest.mark.parametrize("dtype", [np.int32, np.float64])
+def test_repair_scan_keeps_raw_values(tmp_path, dtype):
+    rng = np.random.default_rng(3)
+    # Neither fits exactly in float32
+    if dtype == np.int32:
+        bad_arr = rng.integers(2**24, 2**31 - 1, size=(4, 3, 5, 9), dtype=dtype)
+    else:
+        bad_arr = 1 + rng.normal(size=(4, 3, 5, 9)) * 1e-9
+    bad_path = tmp_path / "bad.nii.gz"
+    img = nib.Nifti1Image(bad_arr, np.eye(4))
+    img.header.set_slope_inter(1, 0)
+    nib.save(img, bad_path)
+
+    repair_scan(bad_path, tmp_path / "new.nii.gz", chunk_size=2)
+    new_img = nib.load(tmp_path / "new.nii.gz")
+    assert new_img.get_data_dtype() == dtype
+    np.testing.assert_array_equal(
+        np.asanyarray(new_img.dataobj), destripe_img(bad_arr)
+    )
@@ -0,0 +1,81 @@
+import numpy as np
+import nibabel as nib
+import pytest
+
+from utils.reductions import (
+    bold_reductions,
+    global_signal,
+    iter_volumes,
+    slice_signals,
+    temporal_mean,
+    temporal_std,
+    tsnr
+)
+
+
+@pytest.fixture
+def bold_path(tmp_path):
+    # Scaled int16 data, read through the slope and intercept
+    arr = np.random.default_rng(0).integers(0, 1000, size=(6, 5, 4, 23))
+    img = nib.Nifti1Image(arr.astype(np.int16), np.eye(4))
+    img.header.set_slope_inter(0.5, 10)
+    path = tmp_path / "bold.nii.gz"
+    nib.save(img, path)
+    return path
+
+
+def test_iter_volumes_matches_get_fdata(bold_path):
+    data = nib.load(bold_path).get_fdata()
+    t0s, chunks = zip(*iter_volumes(bold_path, chunk_size=5))
+    assert t0s == (0, 5, 10, 15, 20)
+    assert all(chunk.dtype == np.float32 for chunk in chunks)
+    np.testing.assert_allclose(np.concatenate(chunks, axis=3), data)
+
+    chunks = [chunk for _, chunk in iter_volumes(bold_path, 4, 3, 13)]
+    np.testing.assert_allclose(np.concatenate(chunks, axis=3), data[..., 3:13])
+
+
+def test_bold_reductions_match_get_fdata(bold_path):
+    data = nib.load(bold_path).get_fdata()
+    mean, std = data.mean(axis=3), data.std(axis=3)
+    reductions = bold_reductions(bold_path, chunk_size=5)
+
+    np.testing.assert_allclose(reductions["mean"], mean, rtol=1e-6)
+    np.testing.assert_allclose(reductions["std"], std, rtol=1e-4)
+    np.testing.assert_allclose(reductions["tsnr"], mean / std, rtol=1e-4)
+    np.testing.assert_allclose(
+        reductions["slice_signals"], data.mean(axis=(0, 1)), rtol=1e-6
+    )
+    np.testing.assert_allclose(
+        reductions["global_signal"], data.mean(axis=(0, 1, 2)), rtol=1e-6
+    )
+    np.testing.assert_array_equal(reductions["last_volume"], data[..., -1])
+
+
+def test_bold_reductions_of_a_proxy_and_an_array(bold_path):
+    img = nib.load(bold_path, keep_file_open=True)
+    from_proxy = bold_reductions(img.dataobj, chunk_size=7)
+    from_array = bold_reductions(img.get_fdata(), chunk_size=7)
+    for name, value in from_proxy.items():
+        np.testing.assert_allclose(value, from_array[name], rtol=1e-6)
+
+
+def test_3d_image_is_a_single_volume():
+    volume = np.random.default_rng(1).normal(size=(4, 5, 6))
+    reductions = bold_reductions(volume)
+    np.testing.assert_allclose(reductions["mean"], volume, rtol=1e-6)
+    assert reductions["slice_signals"].shape == (6, 1)
+
+
+def test_single_reductions_match_bold_reductions(bold_path):
+    reductions = bold_reductions(bold_path, chunk_size=5)
+    for name, reduction in [
+        ("mean", temporal_mean),
+        ("std", temporal_std),
+        ("tsnr", tsnr),
+        ("slice_signals", slice_signals),
+        ("global_signal", global_signal)
+    ]:
+        value = reduction(bold_path, chunk_size=5)
+        assert value.dtype == np.float32
+        np.testing.assert_array_equal(value, reductions[name])
@@ -0,0 +1,57 @@
+import numpy as np
+import nibabel as nib
+import pytest
+
+from utils.reports import render_reports, ReportPage
+from utils.signal_cache import signal_cache_dir
+
+
+@pytest.fixture
+def bids_scans(tmp_path):
+    rng = np.random.default_rng(0)
+    paths = {}
+    for datatype, suffix, shape in [
+        ("anat", "T1w", (8, 9, 10)),
+        ("func", "bold", (8, 9, 10, 12))
+    ]:
+        path = tmp_path / "sub-01" / "ses-M000" / datatype
+        path.mkdir(parents=True)
+        paths[suffix] = path / f"sub-01_ses-M000_{suffix}.nii.gz"
+        img = nib.Nifti1Image(rng.normal(size=shape).astype(np.float32), np.eye(4))
+        img.header.set_xyzt_units("mm", "sec")
+        nib.save(img, paths[suffix])
+    return paths
+
+
+def test_slice_signals_are_cached_for_signal_views_of_bold(tmp_path, bids_scans):
+    cache_dir = signal_cache_dir(bids_scans["bold"])
+    render_reports({
+        tmp_path / "anat.pdf": [ReportPage(bids_scans["T1w"], "mean")],
+        tmp_path / "bold.pdf": [ReportPage(bids_scans["bold"], "mean")],
+    })
+    assert not cache_dir.exists()
+
+    render_reports({
+        tmp_path / "bold.pdf": [
+            ReportPage(bids_scans["bold"], "mean"),
+            ReportPage(bids_scans["bold"], "global_signal")
+        ]
+    })
+    assert [path.name.split(".")[0] for path in cache_dir.iterdir()] == [
+        "sub-01_ses-M000_bold"
+    ]
+
+
+def test_every_report_gets_a_pdf(tmp_path, bids_scans):
+    volume = np.random.default_rng(1).normal(size=(5, 6, 7))
+    reports = {
+        tmp_path / "a.pdf": [
+            ReportPage(bids_scans["bold"], "last"),
+            ReportPage(bids_scans["bold"], "periodogram"),
+            ReportPage(volume, "slices")
+        ],
+        tmp_path / "empty.pdf": [],
+    }
+    render_reports(reports, n_jobs=2)
+    for pdf_path in reports:
+        assert pdf_path.read_bytes().startswith(b"%PDF")
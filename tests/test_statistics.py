@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from scipy import stats
+
+from slice_timing.statistics import (
+    _padded_median,
+    bootstrap_median_pvalues,
+    grouped_bootstrap_medians,
+    pad_groups
+)
+
+
+@pytest.fixture
+def groups():
+    rng = np.random.default_rng(0)
+    return [rng.normal(loc, size=size) for loc, size in
+            [(0.5, 7), (0.0, 12), (-1.0, 30), (0.2, 1), (2.0, 100)]]
+
+
+def test_padded_median_is_the_median(groups):
+    padded, sizes = pad_groups(groups)
+    medians = _padded_median(padded[:, np.newaxis, :], sizes)[:, 0]
+    np.testing.assert_array_equal(medians, [np.median(g) for g in groups])
+
+
+def test_bootstrap_medians_are_medians_of_resamples(groups):
+    medians = grouped_bootstrap_medians(groups, [5, 10, 20, 3, 8], seed=0)
+    assert medians.shape == (len(groups), 20)
+    for group, group_medians, n_resamples in zip(groups, medians, [5, 10, 20, 3, 8]):
+        assert not np.isnan(group_medians[:n_resamples]).any()
+        assert np.isnan(group_medians[n_resamples:]).all()
+        if len(group) % 2:
+            # The median of an odd sized resample is one of the samples
+            assert np.isin(group_medians[:n_resamples], group).all()
+
+    # A group of one sample is always resampled to itself
+    np.testing.assert_array_equal(medians[3, :3], groups[3][0])
+
+
+def test_bootstrap_medians_are_reproducible(groups):
+    np.testing.assert_array_equal(
+        grouped_bootstrap_medians(groups, 50, batch_size=16, seed=3),
+        grouped_bootstrap_medians(groups, 50, batch_size=16, seed=3)
+    )
+
+
+def test_pvalues_are_ttests_of_the_bootstrap_medians(groups):
+    groups = [g for g in groups if len(g) > 1]
+    n_resamples = 10 * np.array([len(g) for g in groups])
+    medians = grouped_bootstrap_medians(groups, n_resamples, seed=1)
+    pvalues = bootstrap_median_pvalues(groups, seed=1)
+
+    expected = [
+        stats.ttest_1samp(group_medians[:n], 0).pvalue
+        for group_medians, n in zip(medians, n_resamples)
+    ]
+    np.testing.assert_allclose(pvalues, expected, rtol=1e-10)
@@ -1,64 +1,148 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
 import numpy as np
 import nibabel as nib
 
+from utils.atomic import atomic_output
+from utils.reductions import iter_volumes
+
+
+@lru_cache(maxsize=None)
+def destripe_index(z_size, n_TR):
+    """
+    Gather index of destripe_img for scans of z_size slices
+    and n_TR volumes. The carpet stores the time series of the
+    slices one after the other, volume after volume, so the
+    element c of slice s is the k = s * n_TR + c th element
+    of the carpet, which lies in slice k % z_size of volume
+    k // z_size.
+
+    Returns:
+        np.ndarray: Read-only flat index of shape (z_size * n_TR,),
+        into the (z, t) plane flattened in C order
+    """
+    k = np.arange(z_size * n_TR)
+    index = (k % z_size) * n_TR + k // z_size
+    index.setflags(write=False)
+    return index
+
+
+@lru_cache(maxsize=None)
+def destripe_inverse_index(z_size, n_TR):
+    """
+    Inverse permutation of destripe_index, to scatter the carpet
+    instead of gathering it: the element j of the flat (z, t) plane
+    of the carpet goes to the element destripe_inverse_index[j]
+    of the repaired one.
+
+    Returns:
+        np.ndarray: Read-only flat index of shape (z_size * n_TR,)
+    """
+    index = destripe_index(z_size, n_TR)
+    inverse = np.empty_like(index)
+    inverse[index] = np.arange(index.size)
+    inverse.setflags(write=False)
+    return inverse
 
 
 def destripe_img(bad_img : np.ndarray):
     """
     Vectorized version of unstripping
-    function.
+    function. The rearrangement is a single gather
+    with an index cached for each (z, t) shape.
 
     Args:
         bad_img : 4D numpy array containing
         a permuted, carpet like image
 
     Returns:
-        np.ndarray: Rearranged array
+        np.ndarray: Rearranged array, with the dtype of bad_img
     """
-    new_arr = np.zeros_like(bad_img)
-
-    n_TR = bad_img.shape[-1]
-    z_size = bad_img.shape[2]
-
-    slice_idx : int = 0
-    time_idx : int  = 0
-    old_t_idx : int = 0
-    offset : int = 0
+    x, y, z_size, n_TR = bad_img.shape
+    return np.take(
+        bad_img.reshape(x, y, z_size * n_TR),
+        destripe_index(z_size, n_TR),
+        axis=2
+    ).reshape(bad_img.shape)
+
+def _repaired_dtype(img):
+    # Raw values can be kept only if they are not scaled. nibabel
+    # moves the scaling of the header to the proxy when loading
+    if img.dataobj.slope == 1 and img.dataobj.inter == 0:
+        return img.get_data_dtype()
+    return np.dtype(np.float32)
+
+
+def repair_scan(bad_path, new_path, chunk_size=16):
+    """
+    Out-of-core destripe_img of a scan file. The carpet is read
+    forward, chunk_size volumes at a time, and each chunk is scattered
+    to its place in an uncompressed scratch memmap beside new_path,
+    with destripe_inverse_index. Unscaled data are read and written
+    with their own dtype, so the values are copied exactly.
+    The scratch is then compressed to a temporary file which replaces
+    new_path only once complete, so new_path is never half written,
+    even if it is the bad scan itself.
 
-    while slice_idx < z_size:
+    Args:
+        bad_path (Path): Permuted scan
+        new_path (Path): Where to write the repaired scan
+        chunk_size (int, optional): Number of volumes read at once.
+        Defaults to 16.
+    """
+    bad_img = nib.load(bad_path, keep_file_open=True)
+    z_size, n_TR = bad_img.shape[2:]
+    header = bad_img.header.copy()
+    dtype = _repaired_dtype(bad_img)
+    header.set_data_dtype(dtype)
+
+    with tempfile.TemporaryFile(
+        dir=os.path.dirname(os.path.abspath(new_path))
+    ) as scratch:
+        new_arr = np.memmap(
+            scratch, dtype=dtype, mode="w+", shape=bad_img.shape, order="F"
+        )
+        inverse = destripe_inverse_index(z_size, n_TR)
+        slices = np.arange(z_size)[:, np.newaxis]
+        for t0, chunk in iter_volumes(
+            bad_img.dataobj, chunk_size=chunk_size, dtype=dtype
+        ):
+            # Element (s, t) of the carpet plane is its element s * n_TR + t
+            volumes = np.arange(t0, t0 + chunk.shape[3])
+            new_slices, new_volumes = np.divmod(
+                inverse[slices * n_TR + volumes], n_TR
+            )
+            new_arr[:, :, new_slices, new_volumes] = chunk
+        new_arr.flush()
 
-        while time_idx + z_size <= n_TR:
-            print(time_idx)
-            new_arr[:, :, slice_idx, time_idx:time_idx+z_size] = bad_img[:, :, :, old_t_idx]
-            time_idx += z_size
-            old_t_idx += 1
+        new_img = nib.Nifti1Image(new_arr, bad_img.affine, header)
+        with atomic_output(new_path) as tmp_path:
+            nib.save(new_img, tmp_path)
 
-        offset = (n_TR - z_size + offset) % z_size
 
-        # If the current slice has been perfectly filled with the current
-        # channel, jump to next slice
-        if offset == 0:
-            slice_idx += 1
-            time_idx = 0
+def convert_outliers(
+    outliers,
+    layout,
+    overwrite_bids=False,
+    n_jobs=1,
+    output_dir="/tmp/permutation_experiment"
+):
+    """
+    Repairs permuted scans with repair_scan.
 
-        # Complete current slice up to the offset and start the next slice with what's left
-        else:
-            print(f"Filling slice {slice_idx}, offset = {offset}", time_idx)
-            new_arr[:, :, slice_idx, time_idx:time_idx+offset] = bad_img[:, :, :offset, old_t_idx]
-
-            slice_idx += 1
-
-            # Fill the next slice with the rest of the old channel
-            # only if the top of the volume has not been reached
-            if slice_idx < z_size:
-                time_idx = 0
-                new_arr[:, :, slice_idx, time_idx:(z_size - offset)] = bad_img[:, :, offset:, old_t_idx]
-                time_idx += z_size - offset
-                old_t_idx += 1
-    
-    return new_arr
-
-def convert_outliers(outliers, layout, overwrite_bids=False):
+    Args:
+        outliers (pd.DataFrame): participant_id and session of the scans
+        layout (BIDSLayout): Layout of the dataset
+        overwrite_bids (bool, optional): Replace the scans in the
+        dataset instead of writing them to output_dir. Defaults to False.
+        n_jobs (int, optional): Number of scans repaired at the same time.
+        Defaults to 1.
+        output_dir (Path, optional): Defaults to /tmp/permutation_experiment.
+    """
+    bad_paths, new_paths = [], []
     for _, s in outliers.iterrows():
         bad_rsfmri = layout.get(
             subject=s.participant_id[4:],
@@ -66,15 +150,19 @@ def convert_outliers(outliers, layout, overwrite_bids=False):
             suffix="bold",
             extension="nii.gz"
         )[0]
-        bad_img = nib.load(bad_rsfmri.path)
-
-        new_arr = destripe_img(bad_img.get_fdata())
-        new_img = nib.Nifti1Image(new_arr, bad_img.affine, bad_img.header)
+        bad_paths.append(bad_rsfmri.path)
         if overwrite_bids:
-            nib.save(new_img, bad_rsfmri.path)
+            new_paths.append(bad_rsfmri.path)
         else:
-            nib.save(
-                new_img,
-                f"/tmp/permutation_experiment/{bad_rsfmri.filename}"
-            )
-
+            new_paths.append(os.path.join(output_dir, bad_rsfmri.filename))
+
+    if not overwrite_bids:
+        os.makedirs(output_dir, exist_ok=True)
+
+    if n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            # Consume the results to raise the errors of the workers
+            list(pool.map(repair_scan, bad_paths, new_paths))
+    else:
+        for bad_path, new_path in zip(bad_paths, new_paths):
+            repair_scan(bad_path, new_path)
@@ -0,0 +1,26 @@
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from uuid import uuid4
+
+
+@contextmanager
+def atomic_output(path):
+    """
+    Yields a temporary path beside path. The temporary file
+    replaces path only if the block exits without error,
+    so readers never see a half-written file.
+    The temporary name keeps the extension of path, so that
+    writers inferring the format from it (e.g. nibabel) work.
+
+    Args:
+        path (Path): Final destination of the file
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{uuid4().hex[:8]}.{path.name}")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
@@ -1,6 +1,11 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from typing import Generator, Collection
 from pathlib import Path
 
+from mappings.fnames import ALL_T1_FNAMES, ALL_BOLD_FNAMES
+from utils.memento_structure import extract_info
+
 def recursive_file_matcher(input_path: Path, matching_names: Collection) -> Generator:
     """Matches all imaging files from input path for which
     the name is specified within the set of matching names
@@ -17,3 +22,83 @@ def recursive_file_matcher(input_path: Path, matching_names: Collection) -> Gene
             yield from recursive_file_matcher(child, matching_names)
         if child.name in matching_names:
             yield child
+
+
+class MementoIndex(dict):
+    """
+    In-memory index of memento imaging files.
+    Keys are (centre, subject, month) tuples and values
+    are the lists of matching paths found for this key.
+    """
+
+    def paths(self, matching_names: Collection) -> list:
+        """Lists the indexed files whose name is in matching_names.
+        For each key, files are sorted following the order of
+        matching_names, so the first file of a key is the
+        preferred one.
+        """
+        priority = {fname: rank for rank, fname in enumerate(matching_names)}
+        paths = []
+        for fpaths in self.values():
+            paths.extend(
+                sorted(
+                    (fpath for fpath in fpaths if fpath.name in priority),
+                    key=lambda fpath: (priority[fpath.name], fpath)
+                )
+            )
+        return paths
+
+
+def _scan_dir(path, matching_names):
+    subdirs, matches = [], []
+    with os.scandir(path) as it:
+        for entry in it:
+            # DirEntry caches the file type, no extra stat
+            if entry.is_dir():
+                subdirs.append(entry.path)
+            elif entry.name in matching_names:
+                matches.append(Path(entry.path))
+    return subdirs, matches
+
+
+def index_memento_files(
+    input_path: Path,
+    matching_names: Collection = ALL_T1_FNAMES + ALL_BOLD_FNAMES,
+    n_threads: int = 16
+) -> MementoIndex:
+    """Walks input_path once and indexes all the files
+    for which the name is in matching_names. Directories
+    are read concurrently, which hides the latency of
+    network storage.
+
+    Args:
+        input_path (Path): Root of the memento directory.
+        matching_names (Collection, optional): File names to index.
+        Defaults to all the known T1w and bold file names.
+        n_threads (int, optional): Number of directories read
+        at the same time. Defaults to 16.
+
+    Returns:
+        MementoIndex: Matching files grouped by (centre, subject, month)
+    """
+    matching_names = frozenset(matching_names)
+    matches = []
+
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        pending = {pool.submit(_scan_dir, input_path, matching_names)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                subdirs, found = future.result()
+                matches.extend(found)
+                pending.update(
+                    pool.submit(_scan_dir, subdir, matching_names)
+                    for subdir in subdirs
+                )
+
+    # Threads complete in any order, sort to stay deterministic
+    index = MementoIndex()
+    for fpath in sorted(matches):
+        centre, month, subject_id = extract_info(fpath)
+        index.setdefault((centre, subject_id, month), []).append(fpath)
+    return index
@@ -0,0 +1,102 @@
+import zlib
+
+import numpy as np
+
+
+def encode_page(rgba, dpi):
+    """
+    Compresses the pixels of a page, so that writing the page
+    to an ImagePdf only copies bytes.
+
+    Args:
+        rgba (np.ndarray): Pixels of shape (height, width, 4),
+        first row at the top as in Agg buffers
+        dpi (float): Resolution of the pixels
+
+    Returns:
+        tuple: width, height, dpi and deflated RGB bytes
+    """
+    height, width = rgba.shape[:2]
+    rgb = np.ascontiguousarray(rgba[..., :3])
+    return width, height, dpi, zlib.compress(rgb.tobytes(), 6)
+
+
+class ImagePdf:
+    """
+    Minimal pdf file made of one full page image per page,
+    written as the pages come. Pages are added with the output
+    of encode_page, so the pixels are compressed by whoever
+    draws them.
+    Objects 1 and 2 are the catalog and the page tree, written
+    when the file is closed along with the cross-reference table.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.offsets = {}
+        self.pages = []
+        self.file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write_object(self, dictionary, stream=None, number=None):
+        # dictionary holds the entries of the object, without << >>
+        if number is None:
+            number = max(self.offsets, default=2) + 1
+        self.offsets[number] = self.file.tell()
+        if stream is None:
+            self.file.write(
+                f"{number} 0 obj\n<< {dictionary} >>\nendobj\n".encode()
+            )
+        else:
+            self.file.write(
+                f"{number} 0 obj\n<< {dictionary} /Length {len(stream)} >>\n"
+                "stream\n".encode()
+            )
+            self.file.write(stream + b"\nendstream\nendobj\n")
+        return number
+
+    def add_page(self, width, height, dpi, data):
+        """Adds a page, arguments being the output of encode_page"""
+        image = self._write_object(
+            f"/Type /XObject /Subtype /Image /Width {width} "
+            f"/Height {height} /ColorSpace /DeviceRGB /BitsPerComponent 8 "
+            "/Filter /FlateDecode",
+            data
+        )
+        # Page size in points, 72 per inch
+        page_width, page_height = width * 72 / dpi, height * 72 / dpi
+        contents = self._write_object(
+            "",
+            f"q {page_width:.3f} 0 0 {page_height:.3f} 0 0 cm /Im Do Q".encode()
+        )
+        self.pages.append(self._write_object(
+            f"/Type /Page /Parent 2 0 R "
+            f"/MediaBox [0 0 {page_width:.3f} {page_height:.3f}] "
+            f"/Resources << /XObject << /Im {image} 0 R >> >> "
+            f"/Contents {contents} 0 R"
+        ))
+
+    def close(self):
+        if self.file.closed:
+            return
+        kids = " ".join(f"{page} 0 R" for page in self.pages)
+        self._write_object(
+            f"/Type /Pages /Kids [{kids}] /Count {len(self.pages)}", number=2
+        )
+        self._write_object("/Type /Catalog /Pages 2 0 R", number=1)
+
+        xref = self.file.tell()
+        size = max(self.offsets) + 1
+        self.file.write(f"xref\n0 {size}\n0000000000 65535 f \n".encode())
+        for number in range(1, size):
+            self.file.write(f"{self.offsets[number]:010d} 00000 n \n".encode())
+        self.file.write(
+            f"trailer\n<< /Size {size} /Root 1 0 R >>\n"
+            f"startxref\n{xref}\n%%EOF\n".encode()
+        )
+        self.file.close()
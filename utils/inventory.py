@@ -0,0 +1,127 @@
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from utils.sequence_report import header_census, REPORT_COLUMNS, REPORT_DTYPES
+
+# nifti_path is the key, REPORT_COLUMNS are the cached values
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    nifti_path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    subject_id TEXT,
+    centre TEXT,
+    month TEXT,
+    is_4D INTEGER,
+    "Tr (s)" REAL,
+    x INTEGER,
+    y INTEGER,
+    z INTEGER,
+    t INTEGER,
+    vox_units TEXT,
+    time_units TEXT
+)
+"""
+
+_TABLE_COLUMNS = ["nifti_path", "size", "mtime_ns"] + [
+    col for col in REPORT_COLUMNS if col != "nifti_path"
+]
+
+_INSERT = f"INSERT OR REPLACE INTO scans VALUES ({', '.join('?' * len(_TABLE_COLUMNS))})"
+
+
+def _stat(nifti_path):
+    stat = os.stat(nifti_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class ScanInventory:
+    """
+    Persistent cache of sequence reports, stored in a SQLite file.
+    A file is read again only if its size or modification time changed.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def refresh(self, nifti_paths, n_threads=16, prune=True):
+        """
+        Brings the inventory up to date with nifti_paths.
+
+        Args:
+            nifti_paths (Iterable): Files which should be in the inventory
+            n_threads (int, optional): Number of files stated and read
+            at the same time. Defaults to 16.
+            prune (bool, optional): Forget files which are not in
+            nifti_paths anymore. Defaults to True.
+
+        Returns:
+            int: Number of new or modified files which have been read
+        """
+        nifti_paths = [Path(nifti_path) for nifti_path in nifti_paths]
+        with ThreadPoolExecutor(max_workers=n_threads) as pool:
+            stats = list(pool.map(_stat, nifti_paths))
+
+        known = {
+            path: (size, mtime_ns)
+            for path, size, mtime_ns in self.connection.execute(
+                "SELECT nifti_path, size, mtime_ns FROM scans"
+            )
+        }
+        stale = [
+            (nifti_path, stat) for nifti_path, stat in zip(nifti_paths, stats)
+            if known.get(str(nifti_path)) != stat
+        ]
+
+        census = header_census(
+            [nifti_path for nifti_path, _ in stale],
+            n_threads=n_threads
+        )
+        census["nifti_path"] = census["nifti_path"].map(str)
+        census["size"] = [size for _, (size, _) in stale]
+        census["mtime_ns"] = [mtime_ns for _, (_, mtime_ns) in stale]
+        # object dtype turns numpy scalars into python ones for sqlite
+        rows = census.loc[:, _TABLE_COLUMNS].astype(object).itertuples(index=False)
+
+        with self.connection:
+            self.connection.executemany(_INSERT, rows)
+            if prune:
+                current = {str(nifti_path) for nifti_path in nifti_paths}
+                self.connection.executemany(
+                    "DELETE FROM scans WHERE nifti_path = ?",
+                    [(path,) for path in known.keys() - current]
+                )
+
+        return len(stale)
+
+    def to_frame(self, nifti_paths=None) -> pd.DataFrame:
+        """
+        Returns the cached reports, with the same columns and dtypes
+        as header_census. If nifti_paths is given, only these files
+        are returned, in the same order.
+        """
+        df = pd.read_sql_query("SELECT * FROM scans", self.connection)
+        if nifti_paths is not None:
+            order = [str(nifti_path) for nifti_path in nifti_paths]
+            df = df.set_index("nifti_path").reindex(order).dropna(
+                subset=["subject_id"]
+            ).reset_index()
+
+        df = df.loc[:, REPORT_COLUMNS]
+        df["nifti_path"] = df["nifti_path"].map(Path)
+        return df.astype(REPORT_DTYPES)
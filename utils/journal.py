@@ -0,0 +1,49 @@
+import os
+
+
+class ConversionJournal(dict):
+    """
+    Append-only record of completed conversions, stored as a tsv file.
+    Maps (sub, ses, suffix) keys to the completed entries, so that
+    an interrupted conversion can skip them when it restarts.
+    Each entry is flushed to disk as soon as it is recorded.
+    """
+    columns = ("sub", "ses", "suffix", "site", "source")
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+        valid_size = 0
+        if os.path.isfile(path):
+            with open(path, "rb") as file:
+                for line in file:
+                    # A line without newline was cut by a crash
+                    if not line.endswith(b"\n"):
+                        break
+                    valid_size += len(line)
+                    values = line.decode().rstrip("\n").split("\t")
+                    entry = dict(zip(self.columns, values))
+                    self[entry["sub"], entry["ses"], entry["suffix"]] = entry
+
+        self.file = open(path, "a")
+        # Drop the end of a partially written line
+        self.file.truncate(valid_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def record(self, sub, ses, suffix, site, source):
+        entry = dict(sub=sub, ses=ses, suffix=suffix, site=site, source=source)
+        self.file.write(
+            "\t".join(str(entry[col]) for col in self.columns) + "\n"
+        )
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self[sub, ses, suffix] = entry
@@ -0,0 +1,59 @@
+import os
+import shutil
+
+from nibabel.openers import Opener
+
+from utils.sequence_report import read_nifti_header
+
+
+def _is_gzip(path):
+    return str(path).endswith(".gz")
+
+
+def copy_with_header(src, dst, header, src_header=None, chunk_size=2**22):
+    """
+    Copies a NIfTI file, replacing its header by header,
+    without decoding the voxel data. When header is the one of src
+    and both files have the same compression, the bytes of src
+    are copied as they are. Otherwise the payload is streamed
+    from src to dst chunk by chunk, which recompresses it since
+    a gzip stream can not be spliced.
+    Compression of src and dst is inferred from their extension.
+
+    Args:
+        src (Path): Source NIfTI file
+        dst (Path): Destination NIfTI file
+        header (Nifti1Header): Header to write, typically obtained
+        with read_nifti_header(src) and then modified. It must keep
+        the size and vox_offset of the source header.
+        src_header (Nifti1Header, optional): Header of src, when it
+        has already been read. Defaults to read_nifti_header(src).
+        chunk_size (int, optional): Number of bytes read at once.
+        Defaults to 4MB.
+    """
+    if src_header is None:
+        src_header = read_nifti_header(src)
+    block = header.binaryblock
+    if (
+        len(block) != len(src_header.binaryblock)
+        or header["vox_offset"] != src_header["vox_offset"]
+    ):
+        raise ValueError(
+            f"New header of {dst} does not have the layout of {src} header"
+        )
+
+    if block == src_header.binaryblock and _is_gzip(src) == _is_gzip(dst):
+        shutil.copyfile(src, dst)
+        return
+
+    try:
+        with Opener(src, "rb") as fin, Opener(dst, "wb") as fout:
+            fin.read(len(block))
+            fout.write(block)
+            # Extensions and voxel data are copied as they are
+            shutil.copyfileobj(fin, fout, chunk_size)
+    except BaseException:
+        # Never leave a truncated image behind
+        if os.path.isfile(dst):
+            os.remove(dst)
+        raise
@@ -0,0 +1,142 @@
+import os
+
+import numpy as np
+import nibabel as nib
+
+
+def _dataobj(img):
+    if isinstance(img, np.ndarray) or nib.is_proxy(img):
+        return img
+    if not isinstance(img, (str, os.PathLike)):
+        if not nib.is_proxy(img.dataobj) or img.get_filename() is None:
+            return img.dataobj
+        img = img.get_filename()
+    # Keeping the file open makes consecutive chunks of a
+    # compressed file read forward, instead of inflating
+    # the stream from the start for each chunk
+    return nib.load(img, keep_file_open=True).dataobj
+
+
+def iter_volumes(img, chunk_size=16, start=0, stop=None, dtype=np.float32):
+    """Streams a 4D image over time, a few volumes at a time.
+    Only chunk_size volumes are in memory at once.
+
+    Args:
+        img: Path, nibabel image, array proxy or array. 3D images
+        are seen as a single volume.
+        chunk_size (int, optional): Number of volumes per chunk.
+        Defaults to 16.
+        start (int, optional): First volume. Defaults to 0.
+        stop (int, optional): Volume where to stop, excluded.
+        Defaults to the end of the series.
+        dtype (np.dtype, optional): dtype of the chunks, None keeping
+        the one of the data as read. Defaults to np.float32.
+
+    Yields:
+        tuple: (t0, chunk) where chunk is an array of shape
+        (x, y, z, k) holding volumes t0 to t0 + k
+    """
+    dataobj = _dataobj(img)
+    if len(dataobj.shape) == 3:
+        yield 0, np.asarray(dataobj, dtype=dtype)[..., np.newaxis]
+        return
+
+    n_TR = dataobj.shape[3] if stop is None else min(stop, dataobj.shape[3])
+    for t0 in range(start, n_TR, chunk_size):
+        t1 = min(t0 + chunk_size, n_TR)
+        yield t0, np.asarray(dataobj[..., t0:t1], dtype=dtype)
+
+
+def bold_reductions(img, chunk_size=16, on_chunk=None):
+    """Computes the usual reductions of a BOLD series
+    in a single pass over the data.
+
+    Args:
+        img: Path, nibabel image, array proxy or array, 3D or 4D
+        chunk_size (int, optional): Number of volumes read at once.
+        Defaults to 16.
+        on_chunk (callable, optional): Called with (t0, chunk) for
+        each chunk, to compute other things during the same pass.
+
+    Returns:
+        dict: "mean", "std" and "tsnr" volumes, "slice_signals"
+        of shape (z, t), "global_signal" of shape (t,) and
+        "last_volume", all in float32
+    """
+    total = None
+    slice_signals = []
+    for t0, chunk in iter_volumes(img, chunk_size=chunk_size):
+        if on_chunk is not None:
+            on_chunk(t0, chunk)
+        if total is None:
+            # float64 accumulators, to keep sums of squares accurate
+            total = np.zeros(chunk.shape[:3])
+            total_sq = np.zeros(chunk.shape[:3])
+        total += chunk.sum(axis=3)
+        total_sq += np.square(chunk, dtype=np.float64).sum(axis=3)
+        slice_signals.append(chunk.mean(axis=(0, 1)))
+        last_volume = chunk[..., -1]
+
+    slice_signals = np.concatenate(slice_signals, axis=1)
+    mean, std = _mean_std(total, total_sq, slice_signals.shape[1])
+
+    return {
+        "mean": mean.astype(np.float32),
+        "std": std.astype(np.float32),
+        "tsnr": _tsnr(mean, std).astype(np.float32),
+        "slice_signals": slice_signals,
+        # All slices have the same number of voxels
+        "global_signal": slice_signals.mean(axis=0),
+        "last_volume": last_volume
+    }
+
+
+def _sums(img, chunk_size, squares=False):
+    # Running float64 sums over time, the only volumes kept in memory
+    total, total_sq, n_TR = None, None, 0
+    for _, chunk in iter_volumes(img, chunk_size=chunk_size):
+        if total is None:
+            total = np.zeros(chunk.shape[:3])
+            if squares:
+                total_sq = np.zeros(chunk.shape[:3])
+        total += chunk.sum(axis=3)
+        if squares:
+            total_sq += np.square(chunk, dtype=np.float64).sum(axis=3)
+        n_TR += chunk.shape[3]
+    return total, total_sq, n_TR
+
+
+def _mean_std(total, total_sq, n_TR):
+    mean = total / n_TR
+    return mean, np.sqrt(np.clip(total_sq / n_TR - np.square(mean), 0, None))
+
+
+def _tsnr(mean, std):
+    return np.divide(mean, std, out=np.zeros_like(mean), where=std > 0)
+
+
+# The single reductions below only accumulate what they return,
+# use bold_reductions to get several of them from one pass
+
+def temporal_mean(img, chunk_size=16):
+    total, _, n_TR = _sums(img, chunk_size)
+    return (total / n_TR).astype(np.float32)
+
+def temporal_std(img, chunk_size=16):
+    _, std = _mean_std(*_sums(img, chunk_size, squares=True))
+    return std.astype(np.float32)
+
+def tsnr(img, chunk_size=16):
+    mean, std = _mean_std(*_sums(img, chunk_size, squares=True))
+    return _tsnr(mean, std).astype(np.float32)
+
+def slice_signals(img, chunk_size=16):
+    """Mean signal of each slice over time, of shape (z, t)"""
+    return np.concatenate(
+        [chunk.mean(axis=(0, 1)) for _, chunk in iter_volumes(img, chunk_size)],
+        axis=1
+    )
+
+def global_signal(img, chunk_size=16):
+    # All slices have the same number of voxels
+    return slice_signals(img, chunk_size).mean(axis=0)
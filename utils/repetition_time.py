@@ -0,0 +1,54 @@
+import pandas as pd
+
+TR_COLUMN = "Tr (s)"
+
+
+def _group_median_TR(known, missing, keys):
+    medians = known.groupby(keys, observed=True)[TR_COLUMN].median()
+    return missing.join(medians.rename("median_TR"), on=keys)["median_TR"]
+
+
+def infer_missing_TRs(df, machines=None, output_path=None):
+    """
+    Infers the TR of the scans for which it is missing (0 in the header),
+    as the median TR of the scans from the same centre with the same
+    number of slices. When no such scan exists, falls back
+    to the scans from the same centre and the same machine.
+
+    Args:
+        df (pd.DataFrame): Sequence reports, as built by header_census
+        machines (pd.DataFrame, optional): subject_id, month and machine
+        columns, as returned by mappings.machines.load_machines. The
+        fallback is skipped if not provided.
+        output_path (Path, optional): Where to write the table read by
+        2_complete_missing_TRs.py. Nothing is written if not provided.
+
+    Returns:
+        pd.DataFrame: Rows of df with a missing TR, with the
+        inferred_TR and TR_source columns
+    """
+    if machines is not None:
+        df = df.join(
+            machines.drop_duplicates(["subject_id", "month"]).set_index(
+                ["subject_id", "month"]
+            )["machine"],
+            on=["subject_id", "month"]
+        )
+
+    known = df[df[TR_COLUMN] != 0]
+    missing = df[df[TR_COLUMN] == 0].copy()
+
+    missing["inferred_TR"] = _group_median_TR(known, missing, ["centre", "z"])
+    missing["TR_source"] = "centre, z"
+
+    if machines is not None:
+        fallback = _group_median_TR(known, missing, ["centre", "machine"])
+        use_fallback = missing["inferred_TR"].isna() & fallback.notna()
+        missing.loc[use_fallback, "inferred_TR"] = fallback[use_fallback]
+        missing.loc[use_fallback, "TR_source"] = "centre, machine"
+
+    missing.loc[missing["inferred_TR"].isna(), "TR_source"] = pd.NA
+
+    if output_path is not None:
+        missing.to_csv(output_path)
+    return missing
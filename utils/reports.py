@@ -0,0 +1,211 @@
+import itertools
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from scipy.signal import periodogram
+
+from utils.atomic import atomic_output
+from utils.image_pdf import encode_page, ImagePdf
+
+from utils.reductions import bold_reductions
+from utils.signal_cache import cached_slice_signals, store_slice_signals
+from utils.sequence_report import read_nifti_header
+
+DPI = 100
+SLICE_NAMES = ("saggital", "coronal", "axial")
+
+# source is a path, or a 3D array for the "slices" view.
+# view is one of "slices", "mean", "last", "global_signal"
+# and "periodogram". Paths are read once for all their views.
+ReportPage = namedtuple(
+    "ReportPage", ["source", "view", "title"], defaults=("mean", "")
+)
+
+# Views which only need the slice signals of the scan
+SIGNAL_VIEWS = ("global_signal", "periodogram")
+
+# Figures of the worker process, reused from one page to the next
+_figures = {}
+
+
+def _slices_figure(dpi):
+    fig = Figure(figsize=(10, 10), dpi=dpi)
+    FigureCanvasAgg(fig)
+    images = []
+    for ax, name in zip(fig.subplots(len(SLICE_NAMES)), SLICE_NAMES):
+        images.append(ax.imshow(np.zeros((2, 2)), cmap="gray", origin="lower"))
+        ax.set_title(name)
+    return fig, images
+
+
+def _line_figure(dpi):
+    fig = Figure(dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    line, = ax.plot([], [])
+    return fig, (ax, line)
+
+
+def _get_figure(kind, dpi):
+    if (kind, dpi) not in _figures:
+        make_figure = _slices_figure if kind == "slices" else _line_figure
+        _figures[kind, dpi] = make_figure(dpi)
+    return _figures[kind, dpi]
+
+
+def _to_rgba(fig):
+    fig.canvas.draw()
+    return np.asarray(fig.canvas.buffer_rgba()).copy()
+
+
+def render_slices(volume, title="", dpi=DPI):
+    """
+    Same page as make_and_show_middle_slices, drawn by updating
+    the images of a reused figure.
+
+    Returns:
+        np.ndarray: RGBA pixels of the page
+    """
+    fig, images = _get_figure("slices", dpi)
+    h, w, d = volume.shape
+    slices = (volume[h//2, :, :], volume[:, w//2, :], volume[:, :, d//2])
+    for image, slice in zip(images, slices):
+        image.set_data(slice.T)
+        image.set_extent((-0.5, slice.shape[0] - 0.5, -0.5, slice.shape[1] - 0.5))
+        image.set_clim(slice.min(), slice.max())
+    fig.suptitle(title)
+    return _to_rgba(fig)
+
+
+def render_line(x, y, title="", xlabel="", ylabel="", dpi=DPI):
+    """
+    Line plot page, drawn by updating the line of a reused figure.
+
+    Returns:
+        np.ndarray: RGBA pixels of the page
+    """
+    fig, (ax, line) = _get_figure("line", dpi)
+    line.set_data(x, y)
+    ax.relim()
+    ax.autoscale_view()
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    return _to_rgba(fig)
+
+
+def _render_pages(pages, dpi=DPI):
+    # All pages of a job share the same source
+    source = pages[0].source
+    views = {page.view for page in pages}
+    signal_views = views & set(SIGNAL_VIEWS)
+    if signal_views:
+        header = read_nifti_header(source)
+        TR = float(header["pixdim"][4])
+        # Only the slice signals of BOLD series are cached
+        cache_signals = header["dim"][0] == 4
+
+    if signal_views and cache_signals and views == signal_views:
+        # The scan is not read if its signals are in the cache
+        slice_signals = cached_slice_signals(source)
+        reductions = {"global_signal": slice_signals.mean(axis=0)}
+    elif views != {"slices"}:
+        reductions = bold_reductions(source)
+        if signal_views and cache_signals:
+            store_slice_signals(source, reductions["slice_signals"])
+
+    rendered = []
+    for page in pages:
+        if page.view == "slices":
+            rendered.append(render_slices(np.asarray(source), page.title, dpi))
+        elif page.view == "mean":
+            rendered.append(render_slices(reductions["mean"], page.title, dpi))
+        elif page.view == "last":
+            rendered.append(render_slices(
+                reductions["last_volume"], page.title, dpi
+            ))
+        elif page.view == "global_signal":
+            ts = reductions["global_signal"]
+            t_axis = np.linspace(0, TR * len(ts), len(ts))
+            rendered.append(render_line(
+                t_axis, ts, page.title, "Time (s)", dpi=dpi
+            ))
+        elif page.view == "periodogram":
+            f, Pxx = periodogram(reductions["global_signal"], fs=1/TR)
+            rendered.append(render_line(
+                f, Pxx, page.title, "frequency [Hz]", "PSD [V**2/Hz]", dpi
+            ))
+        else:
+            raise ValueError(f"Unknown report view {page.view}")
+    # Pages are compressed by the worker, not by the main process
+    return [encode_page(image, dpi) for image in rendered]
+
+
+def _source_key(page):
+    if isinstance(page.source, np.ndarray):
+        return id(page.source)
+    return str(page.source)
+
+
+def _empty_page(pdf_path, dpi):
+    fig = Figure(dpi=dpi)
+    FigureCanvasAgg(fig)
+    fig.text(0.5, 0.5, f"No page in {os.path.basename(pdf_path)}", ha="center")
+    return encode_page(_to_rgba(fig), dpi)
+
+
+def render_reports(reports, n_jobs=1, dpi=DPI):
+    """
+    Renders pdf reports. Pages are drawn in worker processes
+    with the Agg backend, on figures reused from one page to the
+    next, and compressed there. Consecutive pages with the same
+    source are drawn by the same worker, which reads the scan once.
+    The main process only copies the compressed pages to the pdf
+    files, in order, so it does not limit the number of workers.
+    Pages are images of dpi resolution.
+    A report without page gets a single page saying so, so
+    that every key of reports has its pdf.
+
+    Args:
+        reports (dict): Maps pdf paths to lists of ReportPage
+        n_jobs (int, optional): Number of worker processes, negative
+        values count from the number of cores as in joblib.
+        Defaults to 1, rendering in the current process.
+        dpi (int, optional): Resolution of the pages. Defaults to DPI.
+    """
+    if n_jobs < 0:
+        n_jobs = max(os.cpu_count() + 1 + n_jobs, 1)
+
+    jobs = {
+        pdf_path: [
+            list(group)
+            for _, group in itertools.groupby(pages, key=_source_key)
+        ]
+        for pdf_path, pages in reports.items()
+    }
+    all_jobs = list(itertools.chain.from_iterable(jobs.values()))
+    render_pages = partial(_render_pages, dpi=dpi)
+
+    pool = None
+    if n_jobs > 1:
+        pool = ProcessPoolExecutor(max_workers=n_jobs)
+        rendered = pool.map(render_pages, all_jobs)
+    else:
+        rendered = map(render_pages, all_jobs)
+
+    try:
+        for pdf_path, pdf_jobs in jobs.items():
+            with atomic_output(pdf_path) as tmp_path, ImagePdf(tmp_path) as pdf:
+                if not pdf_jobs:
+                    pdf.add_page(*_empty_page(pdf_path, dpi))
+                for pages in itertools.islice(rendered, len(pdf_jobs)):
+                    for page in pages:
+                        pdf.add_page(*page)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
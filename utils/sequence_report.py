@@ -1,35 +1,142 @@
 
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
 import nibabel as nib
 import numpy as np
+import pandas as pd
 from utils.memento_structure import extract_info
-    
-def sequence_report(nifti_path):
-    nifti_img = nib.load(nifti_path)
-    
-    is_4D = (nifti_img.header["dim"][0] == 4)
+
+REPORT_COLUMNS = [
+    "subject_id",
+    "centre",
+    "month",
+    "is_4D",
+    "Tr (s)",
+    "nifti_path",
+    "x",
+    "y",
+    "z",
+    "t",
+    "vox_units",
+    "time_units"
+]
+
+REPORT_DTYPES = {
+    "subject_id": str,
+    "centre": "category",
+    "month": "category",
+    "is_4D": bool,
+    "Tr (s)": np.float32,
+    "x": np.int32,
+    "y": np.int32,
+    "z": np.int32,
+    "t": np.int32,
+    "vox_units": "category",
+    "time_units": "category"
+}
+
+NIFTI1_HEADER_SIZE = 348
+NIFTI2_HEADER_SIZE = 540
+
+
+def _read_head(nifti_path, n_bytes, chunk_size=4096):
+    """
+    Returns the first n_bytes of a NIfTI file. Compressed
+    files are inflated chunk by chunk, and only until
+    n_bytes are available.
+    """
+    with open(nifti_path, "rb") as f:
+        chunk = f.read(chunk_size)
+        if chunk[:2] != b"\x1f\x8b":
+            return (chunk + f.read(max(0, n_bytes - len(chunk))))[:n_bytes]
+
+        # 16 + MAX_WBITS tells zlib to expect a gzip wrapper
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        head = b""
+        while chunk and len(head) < n_bytes:
+            head += decompressor.decompress(chunk, n_bytes - len(head))
+            chunk = decompressor.unconsumed_tail or f.read(chunk_size)
+    return head
+
+
+def read_nifti_header(nifti_path):
+    """
+    Reads the header of a (compressed) NIfTI file without
+    touching the voxel data.
+
+    Args:
+        nifti_path (Path): Path of a .nii or .nii.gz file
+
+    Returns:
+        Nifti1Header or Nifti2Header: header of the image
+    """
+    head = _read_head(nifti_path, NIFTI1_HEADER_SIZE)
+    sizeof_hdr = head[:4]
+    if NIFTI2_HEADER_SIZE in (
+        int.from_bytes(sizeof_hdr, "little"),
+        int.from_bytes(sizeof_hdr, "big")
+    ):
+        head = _read_head(nifti_path, NIFTI2_HEADER_SIZE)
+        return nib.Nifti2Header(head, check=False)
+    return nib.Nifti1Header(head, check=False)
+
+
+def _header_report(nifti_path, header, with_units=True):
+    is_4D = (header["dim"][0] == 4)
     if is_4D:
-        Tr = nifti_img.header["pixdim"][4]
+        Tr = header["pixdim"][4]
     else:
         Tr = np.nan
     centre, month, subject_id = extract_info(nifti_path)
 
-    x, y, z, t = nifti_img.header["dim"][1:5]
+    x, y, z, t = header["dim"][1:5]
+
+    report = (subject_id, centre, month, is_4D, Tr, nifti_path, x, y, z, t)
+    if with_units:
+        report += header.get_xyzt_units()
+    return report
+
 
-    return subject_id, centre, month, is_4D, Tr, nifti_path, x, y, z, t
+def sequence_report(nifti_path):
+    header = read_nifti_header(nifti_path)
+    return _header_report(nifti_path, header, with_units=False)
 
 def sequence_report_with_units(nifti_path):
-    nifti_img = nib.load(nifti_path)
-    
-    is_4D = (nifti_img.header["dim"][0] == 4)
-    if is_4D:
-        Tr = nifti_img.header["pixdim"][4]
-    else:
-        Tr = np.nan
-    centre, month, subject_id = extract_info(nifti_path)
+    header = read_nifti_header(nifti_path)
+    return _header_report(nifti_path, header)
+
+
+def read_nifti_headers(nifti_paths, n_threads=16):
+    """
+    Reads many headers concurrently. zlib releases the GIL
+    and most of the time is spent waiting for the storage,
+    so threads are enough.
+
+    Returns:
+        list: headers, in the order of nifti_paths
+    """
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        return list(pool.map(read_nifti_header, nifti_paths))
+
 
-    x, y, z, t = nifti_img.header["dim"][1:5]
-    
-    vox_units, time_units = nifti_img.header.get_xyzt_units()
+def header_census(nifti_paths, n_threads=16) -> pd.DataFrame:
+    """
+    Dimension, TR and units census of many NIfTI files,
+    only reading their headers.
 
-    return subject_id, centre, month, is_4D, Tr, nifti_path, x, y, z, t, vox_units, time_units
+    Args:
+        nifti_paths (Iterable): Paths of files in memento structure
+        n_threads (int, optional): Number of files read at
+        the same time. Defaults to 16.
 
+    Returns:
+        pd.DataFrame: One row per file, with REPORT_COLUMNS
+    """
+    nifti_paths = list(nifti_paths)
+    headers = read_nifti_headers(nifti_paths, n_threads=n_threads)
+    reports = [
+        _header_report(nifti_path, header)
+        for nifti_path, header in zip(nifti_paths, headers)
+    ]
+    return pd.DataFrame(reports, columns=REPORT_COLUMNS).astype(REPORT_DTYPES)
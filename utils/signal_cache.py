@@ -0,0 +1,89 @@
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+
+from utils.atomic import atomic_output
+from utils.reductions import slice_signals as compute_slice_signals
+from utils.sequence_report import read_nifti_header
+
+SIGNALS_DIR = Path("derivatives") / "memento-qc" / "slice_signals"
+
+
+def signal_cache_dir(path):
+    """
+    Cache directory of a scan of a BIDS dataset, e.g.
+    BIDS/sub-01/ses-M000/func/sub-01_ses-M000_task-rest_bold.nii.gz
+    gives BIDS/derivatives/memento-qc/slice_signals.
+    Returns None for scans outside of a BIDS layout.
+    """
+    path = Path(path).absolute()
+    if len(path.parents) < 4 or not path.parents[2].name.startswith("sub-"):
+        return None
+    return path.parents[3] / SIGNALS_DIR
+
+
+def cache_key(path):
+    """Hash of the size, modification time and header of a scan"""
+    stat = os.stat(path)
+    key = hashlib.sha1(f"{stat.st_size}:{stat.st_mtime_ns}:".encode())
+    key.update(read_nifti_header(path).binaryblock)
+    return key.hexdigest()[:16]
+
+
+def _stem(path):
+    return Path(path).name.split(".")[0]
+
+
+def _entry_path(path, cache_dir):
+    return Path(cache_dir) / f"{_stem(path)}.{cache_key(path)}.npy"
+
+
+def store_slice_signals(path, slice_signals, cache_dir=None):
+    """
+    Stores slice signals computed elsewhere, e.g. by bold_reductions,
+    replacing the entries of older versions of the scan.
+    Nothing is stored if there is no cache directory.
+    """
+    cache_dir = cache_dir or signal_cache_dir(path)
+    if cache_dir is None:
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    entry_path = _entry_path(path, cache_dir)
+    for stale_path in Path(cache_dir).glob(f"{_stem(path)}.*.npy"):
+        if stale_path != entry_path:
+            os.remove(stale_path)
+    with atomic_output(entry_path) as tmp_path:
+        np.save(tmp_path, np.asarray(slice_signals, dtype=np.float32))
+
+
+def cached_slice_signals(path, cache_dir=None, chunk_size=16):
+    """
+    slice_signals of a scan, read from the cache if the scan did not
+    change since it was stored, computed and stored otherwise.
+
+    Args:
+        path (Path): Path of the scan
+        cache_dir (Path, optional): Defaults to signal_cache_dir(path).
+        Without cache directory, signals are computed every time.
+        chunk_size (int, optional): Number of volumes read at once
+        when the signals are computed. Defaults to 16.
+
+    Returns:
+        np.ndarray: float32 array of shape (slice, time)
+    """
+    cache_dir = cache_dir or signal_cache_dir(path)
+    if cache_dir is not None:
+        entry_path = _entry_path(path, cache_dir)
+        if entry_path.is_file():
+            return np.load(entry_path)
+
+    slice_signals = compute_slice_signals(path, chunk_size=chunk_size)
+    store_slice_signals(path, slice_signals, cache_dir)
+    return slice_signals
+
+
+def cached_global_signal(path, cache_dir=None, chunk_size=16):
+    # All slices have the same number of voxels
+    return cached_slice_signals(path, cache_dir, chunk_size).mean(axis=0)
@@ -0,0 +1,149 @@
+import os
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+
+from bids_handlers.path_tools import bids_entities
+from utils.reductions import bold_reductions
+
+PLANES = ("sagittal", "coronal", "axial")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS thumbnails (
+    sub TEXT NOT NULL,
+    ses TEXT NOT NULL,
+    suffix TEXT NOT NULL,
+    view TEXT NOT NULL,
+    plane TEXT NOT NULL,
+    height INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    scale REAL NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (sub, ses, suffix, view, plane)
+)
+"""
+
+
+def thumbnails_path(bids_path):
+    """Default location of the store in a BIDS dataset"""
+    return Path(bids_path) / "derivatives" / "memento-qc" / "thumbnails.sqlite"
+
+
+def middle_slices(volume):
+    """Middle sagittal, coronal and axial slices of a 3D volume"""
+    h, w, d = volume.shape
+    return volume[h//2, :, :], volume[:, w//2, :], volume[:, :, d//2]
+
+
+class ThumbnailStore:
+    """
+    Middle slices of the scans, stored as float16 in a SQLite file
+    and indexed by (sub, ses, suffix, view). view is "mean" for
+    the temporal mean and "last" for the last volume.
+    Slices are divided by their maximum absolute value before being
+    cast, so that float16 never overflows, and scaled back on read.
+    The store is filled during QC by ThumbnailDetector and add_scan,
+    see 3_run_qc.py, not when the dataset is converted.
+
+    Args:
+        db_path (Path): SQLite file of the store
+        readonly (bool, optional): Opens an existing store without
+        creating or modifying anything. Defaults to False.
+
+    Raises:
+        FileNotFoundError: If readonly and db_path does not exist
+    """
+
+    def __init__(self, db_path, readonly=False):
+        self.db_path = db_path
+        if readonly:
+            if not os.path.isfile(db_path):
+                raise FileNotFoundError(
+                    f"No thumbnails in {db_path}, they are stored by 3_run_qc"
+                )
+            self.connection = sqlite3.connect(
+                Path(db_path).absolute().as_uri() + "?mode=ro", uri=True
+            )
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def __contains__(self, key):
+        sub, ses, suffix, view = key
+        return self.connection.execute(
+            "SELECT 1 FROM thumbnails WHERE sub = ? AND ses = ? "
+            "AND suffix = ? AND view = ? LIMIT 1",
+            (sub, ses, suffix, view)
+        ).fetchone() is not None
+
+    def put(self, sub, ses, suffix, volume, view="mean"):
+        """
+        Stores the middle slices of volume, replacing the previous ones.
+
+        Args:
+            sub (str): Subject label, without "sub-"
+            ses (str): Session label, without "ses-"
+            suffix (str): e.g. "bold" or "T1w"
+            volume (np.ndarray): 3D volume
+            view (str, optional): Defaults to "mean".
+        """
+        rows = []
+        for plane, slice in zip(PLANES, middle_slices(volume)):
+            scale = float(np.abs(slice).max()) or 1.0
+            data = (slice / scale).astype(np.float16)
+            rows.append(
+                (sub, ses, suffix, view, plane, *data.shape, scale, data.tobytes())
+            )
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def get(self, sub, ses, suffix, view="mean"):
+        """
+        Returns:
+            tuple: sagittal, coronal and axial slices in float32
+
+        Raises:
+            KeyError: If the scan has no thumbnail
+        """
+        rows = dict(
+            (plane, (height, width, scale, data))
+            for plane, height, width, scale, data in self.connection.execute(
+                "SELECT plane, height, width, scale, data FROM thumbnails "
+                "WHERE sub = ? AND ses = ? AND suffix = ? AND view = ?",
+                (sub, ses, suffix, view)
+            )
+        )
+        if len(rows) != len(PLANES):
+            raise KeyError((sub, ses, suffix, view))
+
+        slices = []
+        for plane in PLANES:
+            height, width, scale, data = rows[plane]
+            slice = np.frombuffer(data, dtype=np.float16).reshape(height, width)
+            slices.append(slice.astype(np.float32) * scale)
+        return tuple(slices)
+
+    def put_reductions(self, path, reductions):
+        """Stores the mean and last volume of bold_reductions of path"""
+        entities = bids_entities(path)
+        key = entities["subject"], entities["session"], entities["suffix"]
+        self.put(*key, reductions["mean"], view="mean")
+        self.put(*key, reductions["last_volume"], view="last")
+
+    def add_scan(self, path, chunk_size=16):
+        """Reads a BIDS scan once and stores its thumbnails"""
+        self.put_reductions(path, bold_reductions(path, chunk_size=chunk_size))
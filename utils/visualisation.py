@@ -3,6 +3,9 @@ import random
 import numpy as np
 import seaborn as sns
 
+from utils.reductions import temporal_mean
+from utils.thumbnails import ThumbnailStore, middle_slices
+
 
 def show_slices(slices):
     
@@ -22,17 +25,31 @@ def show_slices(slices):
 def make_and_show_middle_slices(volume):
     """
     Stupid name
+    4D arrays, nibabel images and paths are averaged
+    over time, streaming the data
+    """
+    if not isinstance(volume, np.ndarray) or volume.ndim == 4:
+        volume = temporal_mean(volume)
+    return show_slices(middle_slices(volume))
+
+
+def show_thumbnail(store, sub, ses, suffix="bold", view="mean"):
+    """
+    Same figure as make_and_show_middle_slices, from the thumbnails
+    of a ThumbnailStore, without reading the scan. Thumbnails only
+    exist for the scans which went through 3_run_qc.
+
+    Args:
+        store: ThumbnailStore or path of its file
+        sub (str): Subject label, without "sub-"
+        ses (str): Session label, without "ses-"
+        suffix (str, optional): Defaults to "bold".
+        view (str, optional): "mean" or "last". Defaults to "mean".
     """
-    if volume.ndim == 4:
-        volume = volume.mean(axis=3)
-    h, w, d = volume.shape
-    return show_slices(
-        (
-            volume[h//2, :, :],
-            volume[:, w//2, :],
-            volume[:, :, d//2]
-        )
-    )
+    if not isinstance(store, ThumbnailStore):
+        with ThumbnailStore(store, readonly=True) as store:
+            return show_slices(store.get(sub, ses, suffix, view))
+    return show_slices(store.get(sub, ses, suffix, view))
 
 def biplot(score, coeff , y, varnames, norm_treshold=0.2, eps=1e-1):
     '''